@@ -6,12 +6,23 @@ provided. It will also provide arbitrary quantities of data in response to
 a GET request that specifies who much data it wants. This is done by giving
 the required amount of data in the URL. For example:
 `http://localhost:8080/2gb` will generate a response with 2GB of payload.
+Alternatively, `http://localhost:8080/file/2gb` will respond with the contents
+of a (cached) 2GB file of random data, which can be sent without copying it
+through userspace.
+
+When gunicorn is installed, running this script serves the app with gunicorn's
+threaded workers, since Flask's development server can't keep up with the
+bandwidth limits we want to test. Otherwise it falls back to Flask's server.
+For an ASGI server instead, `hypercorn randsrv:app --bind :8080` also works.
 """
 
 import argparse
+import os
+import sys
+import tempfile
 from collections.abc import Generator
 
-from flask import Flask, request
+from flask import Flask, Response, request, send_file, stream_with_context
 from flask.typing import ResponseReturnValue, ResponseValue
 
 app = Flask(__name__)
@@ -19,9 +30,15 @@ app = Flask(__name__)
 KILOBYTES = 1024
 MEGABYTES = 1024 * KILOBYTES
 GIGABYTES = 1024 * MEGABYTES
+# Large enough to fill the kernel's socket send buffer with each chunk we yield,
+# and so that even multi-GB responses only take a few hundred iterations to generate
+RESPONSE_CHUNK_SIZE = 4 * MEGABYTES
 RESPONSE_SOURCE_DATA = (
-    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=" * 1000
-)
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=" * 65536
+)[:RESPONSE_CHUNK_SIZE]
+DEFAULT_RESPONSE = RESPONSE_SOURCE_DATA[:32]
+REQUEST_READ_SIZE = 1 * MEGABYTES
+RESPONSE_FILE_DIR = os.path.join(tempfile.gettempdir(), "weir-qos-randsrv")
 
 
 def parse_data_quantity(quantity: str) -> int:
@@ -35,26 +52,61 @@ def parse_data_quantity(quantity: str) -> int:
     return int(quantity)
 
 
-def generate_response_data(num_bytes: int) -> Generator[str]:
-    outstanding = num_bytes
-    while outstanding > len(RESPONSE_SOURCE_DATA):
+def write_random_file(path: str, num_bytes: int) -> None:
+    chunk_size = 1 << 20
+    # Other requests may be serving (or also writing) the file at the same time, so write it under
+    # a temporary name and only move it into place once it is complete
+    out_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        random_fd = os.open("/dev/urandom", os.O_RDONLY)
+        try:
+            # Allocate the whole file up front so the filesystem doesn't have to keep extending it
+            if num_bytes > 0:
+                os.posix_fallocate(out_fd, 0, num_bytes)
+            remaining = num_bytes
+            while remaining > 0:
+                chunk = os.read(random_fd, min(chunk_size, remaining))
+                os.write(out_fd, chunk)
+                remaining -= len(chunk)
+        finally:
+            os.close(random_fd)
+            os.close(out_fd)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def generate_response_data(num_bytes: int) -> Generator[bytes]:
+    # We yield the same (immutable) chunk repeatedly, so only the final partial chunk requires a copy.
+    # WSGI servers require actual bytes objects, so we can't avoid that copy with a memoryview.
+    (full_chunks, remainder) = divmod(num_bytes, len(RESPONSE_SOURCE_DATA))
+    for _ in range(full_chunks):
         yield RESPONSE_SOURCE_DATA
-        outstanding -= len(RESPONSE_SOURCE_DATA)
-    yield RESPONSE_SOURCE_DATA[:outstanding]
+    if remainder > 0:
+        yield RESPONSE_SOURCE_DATA[:remainder]
 
 
 @app.route("/", methods=["GET", "POST", "PUT"])
 def generate_output_noparam() -> ResponseValue:
+    # If the client told us how much content to expect then we can stop reading as soon as we've received it all,
+    # otherwise we just have to keep reading until the stream runs out.
+    remaining = request.content_length
     total_bytes_received = 0
-    bytes_received = 1
-    while bytes_received != 0:
-        bytes_received = len(request.stream.read(4 * KILOBYTES))
+    while remaining is None or remaining > 0:
+        read_size = REQUEST_READ_SIZE
+        if remaining is not None:
+            read_size = min(read_size, remaining)
+        bytes_received = len(request.stream.read(read_size))
+        if bytes_received == 0:
+            break
         total_bytes_received += bytes_received
+        if remaining is not None:
+            remaining -= bytes_received
     print(
         f"{request.method} request has {total_bytes_received} bytes of actual content"
     )
-    default_response_bytes = 32
-    return generate_response_data(default_response_bytes)
+    return DEFAULT_RESPONSE
 
 
 @app.route("/<data_quantity>", methods=["GET"])
@@ -66,7 +118,28 @@ def generate_output(data_quantity: str) -> ResponseReturnValue:
         num_bytes = 0
     print(f"Received GET request for {num_bytes} bytes")
 
-    return generate_response_data(num_bytes), {"Content-Type": "text/plain"}
+    return Response(
+        stream_with_context(generate_response_data(num_bytes)),
+        mimetype="text/plain",
+        direct_passthrough=True,
+    )
+
+
+@app.route("/file/<data_quantity>", methods=["GET"])
+def send_output_file(data_quantity: str) -> ResponseReturnValue:
+    try:
+        num_bytes = parse_data_quantity(data_quantity)
+    except Exception:
+        print(f"Invalid GET data quantity: {data_quantity}, defaulting to 0 bytes...")
+        num_bytes = 0
+    print(f"Received GET request for a file of {num_bytes} bytes")
+
+    # Serving a file lets the WSGI server use sendfile, so the data never has to be copied into userspace
+    os.makedirs(RESPONSE_FILE_DIR, exist_ok=True)
+    path = os.path.join(RESPONSE_FILE_DIR, str(num_bytes))
+    if not os.path.isfile(path):
+        write_random_file(path, num_bytes)
+    return send_file(path, mimetype="application/octet-stream", conditional=False)
 
 
 if __name__ == "__main__":
@@ -74,6 +147,34 @@ if __name__ == "__main__":
     parser.add_argument(
         "-p", "--port", help="Port on which the HTTP server should listen", default=8080
     )
+    parser.add_argument(
+        "--dev-server",
+        help="Use Flask's development server even if gunicorn is available",
+        action="store_true",
+    )
     args = parser.parse_args()
 
-    app.run(port=int(args.port))
+    try:
+        from gunicorn.app.wsgiapp import run  # type: ignore
+    except ImportError:
+        run = None
+
+    if run is None or args.dev_server:
+        app.run(port=int(args.port))
+    else:
+        # gunicorn parses its configuration from the command line, so give it the one it expects
+        sys.argv = [
+            "gunicorn",
+            "--chdir",
+            os.path.dirname(os.path.abspath(__file__)),
+            "--bind",
+            f":{args.port}",
+            "--workers",
+            "2",
+            "--threads",
+            "16",
+            "--worker-class",
+            "gthread",
+            "randsrv:app",
+        ]
+        run()
@@ -23,232 +23,548 @@ pytest --capture=tee-sys .
 
 This should run all the tests, each of which should succeed and output a graph of data transfer.
 The intention is that the correctness of these graphs is verified manually.
+
+If your strace is new enough (5.3+) to support `--seccomp-bpf`, set `STRACE_SECCOMP=1` in the environment to have
+strace install a seccomp filter so that only the traced syscalls stop the traced process. This substantially reduces
+the tracing overhead, which otherwise distorts the very bandwidth we're trying to measure.
+
+Alternatively, set `SYSCALL_TRACER=perf` to trace with `perf trace` instead of strace. This uses kernel tracepoints
+rather than ptrace so has far lower overhead, but requires `perf` to be installed and permission to use it.
+Lower overhead still is `SYSCALL_TRACER=bpftrace`, which runs `bandwidth_agg.bt` to sum the transferred bytes for
+each second in the kernel, so that we only have to read one line per second of transfer. This needs `bpftrace` and
+root privileges. If `bpftrace` isn't installed then we fall back to strace.
+
+Finally, `TRANSFER_DRIVER=aiohttp` does away with both curl and syscall tracing, by performing the transfers in this
+process with aiohttp and counting the bytes as they're sent & received.
 """
 
+import asyncio
+import functools
 import inspect
 import os
 import re
-import statistics
+import selectors
+import shlex
+import shutil
 import subprocess
+import threading
 import time
-from collections.abc import Iterable, Sequence
-from datetime import datetime, timedelta, timezone
-from fcntl import F_GETFL, F_SETFL, fcntl
-from typing import Optional, Tuple
-
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from collections.abc import AsyncIterator, Iterable, Sequence
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import BinaryIO, Tuple
+
+import aiohttp
 import matplotlib.pyplot as plt  # type: ignore
-from randsrv import parse_data_quantity
+import numpy as np
+from randsrv import parse_data_quantity, write_random_file
 
 PORT = 9001
+STRACE_SECCOMP = os.environ.get("STRACE_SECCOMP") == "1"
+SYSCALL_TRACER = os.environ.get("SYSCALL_TRACER", "strace")
+TRANSFER_DRIVER = os.environ.get("TRANSFER_DRIVER", "curl")
+
+
+@dataclass
+class TransferSeries:
+    """
+    A series of data transfer rates, stored as parallel arrays of times (in seconds) and rates (in MB/s).
+    """
 
-TransferDataPoint = Tuple[float, float]
-TransferSeries = list[TransferDataPoint]
+    times: np.ndarray = field(default_factory=lambda: np.zeros(0))
+    rates: np.ndarray = field(default_factory=lambda: np.zeros(0))
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+
+# Matches the strace output lines for syscalls that transfer data, capturing the timestamp, syscall & byte count.
+# This is applied to the whole stderr buffer at once (hence MULTILINE) rather than line-by-line.
+TRANSMIT_RE = re.compile(
+    r"^(?P<timestamp>\d+\.\d+) (?P<syscall>sendto|send|recvfrom|recv)\(.*?\) = (?P<bytes>\d+)$",
+    re.MULTILINE,
+)
+# The equivalent for `perf trace` output, which looks like:
+# `     0.000 ( 0.009 ms): curl/4242 sendto(fd: 5, buff: 0x55d6b1c4a2e0, len: 79) = 79`
+# Note that perf's timestamps are in milliseconds relative to the first traced event.
+PERF_TRANSMIT_RE = re.compile(
+    r"^\s*(?P<timestamp>\d+\.\d+) \(\s*\d+\.\d+ ms\): \S+ (?P<syscall>sendto|recvfrom)\(.*?\) = (?P<bytes>\d+)$",
+    re.MULTILINE,
+)
+# The equivalent for the per-second totals printed by bandwidth_agg.bt, which look like: `@recv[12]: 1048576`
+# Here the timestamp is the number of whole seconds since bpftrace started.
+BPFTRACE_TRANSMIT_RE = re.compile(
+    r"^@(?P<syscall>send|recv)\[(?P<timestamp>\d+)\]: (?P<bytes>\d+)$", re.MULTILINE
+)
+BPFTRACE_SCRIPT = os.path.join(os.path.dirname(__file__), "bandwidth_agg.bt")
 
 
 # We track time in "ticks" (that happen to be 1 second long here) because we need to smooth out the transfer
 # graph somewhat to avoid it being just a rectangle of colour as the data transfer goes from 0 to the limit
 # and back many, many times a second due to our limiting as well as just basic functioning of TCP.
+TICKS_PER_SECOND = 1
+
+
 def time2tick(t_seconds: float) -> int:
-    return int(t_seconds * 1)
+    return int(t_seconds * TICKS_PER_SECOND)
 
 
 def tick2time(tick: int) -> float:
-    return tick / time2tick(1)
+    return tick / TICKS_PER_SECOND
+
+
+def server_url(server: int, path: str = "") -> str:
+    return f"http://localhost:{PORT + ((server - 1) * 100)}/{path}"
+
+
+def auth_header(user: int) -> str:
+    return f"AWS user{user}key901234567890"
+
+
+# Generating these files is relatively slow, so only ever do it once per size during a test run
+@functools.lru_cache(maxsize=None)
+def upload_file(data_quantity: str) -> str:
+    datafile_dir = "/tmp/weir-qos-upload"
+    if not os.path.isdir(datafile_dir):
+        os.mkdir(datafile_dir)
+    upload_path = os.path.join(datafile_dir, data_quantity)
+    if not os.path.isfile(upload_path):
+        write_random_file(upload_path, parse_data_quantity(data_quantity))
+    return upload_path
 
 
 def get_cmd(data: str, server: int, user: int) -> list[str]:
     return [
         "curl",
-        f"http://localhost:{PORT + ((server - 1) * 100)}/{data}",
+        server_url(server, data),
         "-H",
-        f"Authorization: AWS user{user}key901234567890",
+        f"Authorization: {auth_header(user)}",
         "-o",
         "/dev/null",
     ]
 
 
 def post_cmd(data_quantity: str, server: int, user: int) -> list[str]:
-    datafile_dir = "/tmp/weir-qos-upload"
-    if not os.path.isdir(datafile_dir):
-        os.mkdir(datafile_dir)
-    upload_path = os.path.join(datafile_dir, data_quantity)
-    if not os.path.isfile(upload_path):
-        num_bytes = parse_data_quantity(data_quantity)
-        file_result = subprocess.run(
-            f"head -c {num_bytes} /dev/urandom > {upload_path}", shell=True
-        )
-        file_result.check_returncode()
-
     return [
         "curl",
-        f"http://localhost:{PORT + ((server - 1) * 100)}",
+        server_url(server),
         "-H",
-        f"Authorization: AWS user{user}key901234567890",
+        f"Authorization: {auth_header(user)}",
         "-o",
         "/dev/null",
         "--request",
         "POST",
         "--data-binary",
-        f"@{upload_path}",
+        f"@{upload_file(data_quantity)}",
     ]
 
 
-class BandwidthTracingProcess:
-    process_handle: subprocess.Popen
-    stdout_accumulator = ""
-    stderr_accumulator = ""
+# Large enough that we will almost always drain a pipe's entire buffer in a single read
+PIPE_READ_SIZE = 1 << 20
+# The longest we'll wait for output before re-checking whether our processes have terminated
+SELECT_TIMEOUT_SECS = 0.05
+# How much of the end of each process' stderr we keep in memory, to be printed if the process fails
+STDERR_TAIL_SIZE = 4096
+# The most data we'll send or receive at a time when doing transfers in-process
+TRANSFER_CHUNK_SIZE = 64 * 1024
+
 
-    def __init__(self, cmd: list[str], label: "str | None" = None):
+class BandwidthMeter(ABC):
+    """
+    Something performing a data transfer, which keeps track of how much data was sent & received during each tick.
+    """
+
+    label: "str | None"
+    send_per_tick: defaultdict[int, int]
+    recv_per_tick: defaultdict[int, int]
+
+    def __init__(self, label: "str | None") -> None:
         self.label = label
-        self.process_handle = subprocess.Popen(
-            ["strace", "-f", "-e", "trace=network", "-ttt", "--"] + cmd,
-            text=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
+        self.send_per_tick = defaultdict(int)
+        self.recv_per_tick = defaultdict(int)
+
+    @abstractmethod
+    def has_terminated(self) -> bool:
+        pass
+
+    @abstractmethod
+    def has_finished(self) -> bool:
+        """
+        Returns true once the transfer has terminated *and* we have accounted for all of the data it transferred.
+        """
+
+    @abstractmethod
+    def returncode(self) -> int:
+        pass
+
+    @abstractmethod
+    def print_failure(self) -> None:
+        pass
+
+    def parse_network_stats(
+        self, initial_timestamp: float | None = None
+    ) -> "Tuple[TransferSeries, TransferSeries]":
+        def burst2mbps(burst: np.ndarray) -> np.ndarray:
+            burst_megabytes = burst / (1024 * 1024)
+            bursts_per_second = TICKS_PER_SECOND
+            megabytes_per_second = burst_megabytes * bursts_per_second
+            return megabytes_per_second
+
+        assert self.has_finished()
+        if self.returncode() != 0:
+            self.print_failure()
+
+        all_ticks = self.send_per_tick.keys() | self.recv_per_tick.keys()
+        if len(all_ticks) == 0:
+            return (TransferSeries(), TransferSeries())
+        if initial_timestamp is not None:
+            first_tick = time2tick(initial_timestamp)
+        else:
+            first_tick = min(all_ticks)
+        num_ticks = max(max(all_ticks) - first_tick + 1, 0)
+
+        tick_times = np.arange(num_ticks) / TICKS_PER_SECOND
+        (send_bursts, recv_bursts) = [
+            TransferSeries(tick_times, burst2mbps(totals))
+            for totals in (
+                self._totals_per_tick(self.send_per_tick, first_tick, num_ticks),
+                self._totals_per_tick(self.recv_per_tick, first_tick, num_ticks),
+            )
+        ]
+        return (send_bursts, recv_bursts)
+
+    @staticmethod
+    def _totals_per_tick(
+        per_tick: dict[int, int], first_tick: int, num_ticks: int
+    ) -> np.ndarray:
+        totals = np.zeros(num_ticks)
+        ticks = np.fromiter(per_tick.keys(), np.int64, len(per_tick))
+        bytes_per_tick = np.fromiter(per_tick.values(), np.int64, len(per_tick))
+        # Anything from before the initial timestamp we were given would have a negative index,
+        # which numpy would take to count back from the end of totals rather than rejecting
+        in_range = ticks >= first_tick
+        totals[ticks[in_range] - first_tick] = bytes_per_tick[in_range]
+        return totals
+
+
+class BandwidthTracingProcess(BandwidthMeter):
+    # The output pipes of every process that is still producing output are registered here, so that we can
+    # wait for output from all of them at once and only read from the ones that actually have something for us.
+    _SEL = selectors.DefaultSelector()
+
+    process_handle: subprocess.Popen
+    stdout_accumulator: bytearray
+    stderr_tail: bytes
+
+    def __init__(
+        self,
+        cmd: list[str],
+        label: "str | None" = None,
+        save_raw: bool = True,
+        caller_name: "str | None" = None,
+    ):
+        super().__init__(label)
+        self.start_timestamp = datetime.now().timestamp()
+        self.process_handle = self._spawn_tracer(cmd)
+        # Set once the process has been reaped, so we don't keep calling waitpid() on it after that
+        self._returncode: "int | None" = None
+        self.stdout_accumulator = bytearray()
+        self.stderr_tail = b""
+        # We update send_per_tick/recv_per_tick as the tracer output arrives. This saves us from having to
+        # hold onto the (potentially very large) raw trace until the process completes.
+        self._partial_line = b""
+
+        # Save the raw data to disk as we receive it so we can use it again later if necessary.
+        # For example we might want to change the size of each tick,
+        # or we might find a bug in our processing code.
+        self._raw_output: dict[str, BinaryIO] = {}
+        if save_raw:
+            if caller_name is None:
+                caller_name = get_calling_function_name()
+            time_label = datetime.now(tz=timezone.utc).strftime("%Y-%m-%d--%H-%M-%S.%f")
+            path_prefix = f"{time_label}_{caller_name}_{self.label}"
+            self._raw_output["out"] = open(f"{path_prefix}.out.txt", "wb")
+            self._raw_output["err"] = open(f"{path_prefix}.err.txt", "wb")
+
         # We passed PIPE for stdout and stderr so they're defined to not be None
         assert self.process_handle.stdout is not None
         assert self.process_handle.stderr is not None
 
         # We need to mark the stdout & stderr pipes as non-blocking so that reading from them will just
-        # return an empty result instead of waiting for the next line of input. This ensures that we
-        # don't hold up one process because another process (that we're always accumulating input from)
-        # happens to not be writing anything to its output streams.
-        stdout_flags = fcntl(self.process_handle.stdout, F_GETFL)
-        fcntl(self.process_handle.stdout, F_SETFL, stdout_flags | os.O_NONBLOCK)
-        stderr_flags = fcntl(self.process_handle.stderr, F_GETFL)
-        fcntl(self.process_handle.stderr, F_SETFL, stderr_flags | os.O_NONBLOCK)
+        # return an empty result instead of waiting for more input. This ensures that we never hold up
+        # one process because another process happens to not be writing anything to its output streams.
+        os.set_blocking(self.process_handle.stdout.fileno(), False)
+        os.set_blocking(self.process_handle.stderr.fileno(), False)
+        self._SEL.register(
+            self.process_handle.stdout, selectors.EVENT_READ, (self, "out")
+        )
+        self._SEL.register(
+            self.process_handle.stderr, selectors.EVENT_READ, (self, "err")
+        )
+        self._open_streams = {"out", "err"}
+
+    def _spawn_tracer(self, cmd: list[str]) -> subprocess.Popen:
+        self.tracer = SYSCALL_TRACER
+        if self.tracer == "bpftrace" and shutil.which("bpftrace") is None:
+            print("bpftrace is not available, falling back to strace")
+            self.tracer = "strace"
+
+        if self.tracer == "strace":
+            # Only trace the syscalls that actually transfer data, which keeps the number of times the process is
+            # stopped (and the amount of output we have to parse) to a minimum. send & recv are implemented in
+            # terms of sendto & recvfrom, so those are all we need. We also don't follow forks/threads by default
+            # because curl does its transfers on the main thread. If you add a test where that isn't the case
+            # then you'll need `-f` here too.
+            tracer_cmd = ["strace", "-e", "trace=sendto,recvfrom", "-ttt", "--"] + cmd
+            if STRACE_SECCOMP:
+                # --seccomp-bpf only takes effect when following forks
+                tracer_cmd[1:1] = ["--seccomp-bpf", "-f"]
+        elif self.tracer == "perf":
+            tracer_cmd = ["perf", "trace", "-e", "sendto,recvfrom", "--"] + cmd
+        elif self.tracer == "bpftrace":
+            # bpftrace prints to stdout by default, but we look for transfer stats in stderr
+            tracer_cmd = ["bpftrace", "-o", "/dev/stderr", BPFTRACE_SCRIPT]
+            tracer_cmd += ["-c", shlex.join(cmd)]
+        else:
+            raise ValueError(f"Unsupported syscall tracer: {self.tracer}")
+
+        return subprocess.Popen(
+            tracer_cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+    def _transmit_regex(self) -> "re.Pattern[str]":
+        if self.tracer == "perf":
+            return PERF_TRANSMIT_RE
+        elif self.tracer == "bpftrace":
+            return BPFTRACE_TRANSMIT_RE
+        return TRANSMIT_RE
+
+    def _parse_tick(self, timestamp: str) -> int:
+        # perf & bpftrace give us time relative to when they started, which we approximate with our spawn time
+        if self.tracer == "perf":
+            return time2tick(self.start_timestamp + (float(timestamp) / 1000))
+        elif self.tracer == "bpftrace":
+            return time2tick(self.start_timestamp + int(timestamp))
+        if TICKS_PER_SECOND == 1:
+            # With one-second ticks the tick is just the whole seconds part of strace's "<secs>.<usecs>" timestamp,
+            # so we can skip parsing it as a float
+            return int(timestamp.partition(".")[0])
+        return time2tick(float(timestamp))
 
     def has_terminated(self) -> bool:
-        return self.process_handle.poll() is not None
+        if self._returncode is None:
+            self._returncode = self.process_handle.poll()
+        return self._returncode is not None
 
     def returncode(self) -> int:
+        if self._returncode is not None:
+            return self._returncode
         return self.process_handle.returncode
 
-    def accumulate_output(self) -> None:
+    def has_finished(self) -> bool:
+        return len(self._open_streams) == 0 and self.has_terminated()
+
+    def print_failure(self) -> None:
+        print(f"Process terminated with return code: {self.returncode()}")
+        print(f"Process stdout: {self.stdout_accumulator.decode('ascii', 'replace')}")
+        print(f"Process stderr (tail): {self.stderr_tail.decode('ascii', 'replace')}")
+
+    def _drain(self, stream: str) -> None:
         # We passed PIPE for stdout and stderr so they're defined to not be None
         # Assert that here again to satisfy mypy
         assert self.process_handle.stdout is not None
         assert self.process_handle.stderr is not None
+        if stream == "out":
+            pipe = self.process_handle.stdout
+        else:
+            pipe = self.process_handle.stderr
+
+        # Read everything that's currently available in one go rather than line-by-line
+        try:
+            data = os.read(pipe.fileno(), PIPE_READ_SIZE)
+        except BlockingIOError:
+            return
+
+        raw_output = self._raw_output.get(stream)
+        if len(data) == 0:
+            # We only read when the pipe is ready, so an empty read means the process closed its end of it
+            self._SEL.unregister(pipe)
+            self._open_streams.discard(stream)
+            if raw_output is not None:
+                raw_output.close()
+            if stream == "err":
+                # Anything left over is a final line that had no trailing newline
+                self._count_transfers(self._partial_line)
+                self._partial_line = b""
+            return
+
+        if raw_output is not None:
+            raw_output.write(data)
+        if stream == "out":
+            self.stdout_accumulator += data
+        else:
+            self.stderr_tail = (self.stderr_tail + data)[-STDERR_TAIL_SIZE:]
+            # Only parse complete lines, holding onto any partial line until the rest of it arrives
+            (complete_lines, _, self._partial_line) = (
+                self._partial_line + data
+            ).rpartition(b"\n")
+            self._count_transfers(complete_lines)
+
+    def _count_transfers(self, lines: bytes) -> None:
+        rows = [
+            match.group("timestamp", "syscall", "bytes")
+            for match in self._transmit_regex().finditer(
+                lines.decode("ascii", "replace")
+            )
+        ]
+        if len(rows) == 0:
+            return
 
-        # Bound the amount of output we read at a time so that we don't starve other processes
-        for i in range(128):
-            new_stdout = self.process_handle.stdout.readline()
-            new_stderr = self.process_handle.stderr.readline()
-            if len(new_stdout) == 0 and len(new_stderr) == 0:
-                break
-            self.stdout_accumulator += new_stdout
-            self.stderr_accumulator += new_stderr
+        # Sum up the bytes transferred in each direction for each tick with numpy rather than one row at a time.
+        # This also means we don't depend on the rows being in time order (which they aren't for bpftrace).
+        ticks = np.fromiter(
+            (self._parse_tick(t) for (t, _, _) in rows), np.int64, len(rows)
+        )
+        is_send = np.fromiter((s[0] == "s" for (_, s, _) in rows), np.bool_, len(rows))
+        num_bytes = np.fromiter((int(n) for (_, _, n) in rows), np.int64, len(rows))
+
+        first_tick = int(ticks.min())
+        ticks -= first_tick
+        num_ticks = int(ticks.max()) + 1
+        for per_tick, mask in (
+            (self.send_per_tick, is_send),
+            (self.recv_per_tick, ~is_send),
+        ):
+            totals = np.bincount(
+                ticks[mask], weights=num_bytes[mask], minlength=num_ticks
+            )
+            for offset, total in enumerate(totals.tolist()):
+                per_tick[first_tick + offset] += int(total)
 
-    def parse_network_stats(
-        self, initial_timestamp: float | None = None
-    ) -> "Tuple[TransferSeries, TransferSeries]":
-        def burst2mbps(burst: float) -> float:
-            burst_megabytes = burst / (1024 * 1024)
-            bursts_per_second = time2tick(1)
-            megabytes_per_second = burst_megabytes * bursts_per_second
-            return megabytes_per_second
 
-        assert self.has_terminated()
-        if self.returncode() != 0:
-            print(f"Process terminated with return code: {self.returncode()}")
-            print(f"Process stdout: {self.stdout_accumulator}")
-            print(f"Process stderr: {self.stderr_accumulator}")
+class InProcessTransfer(BandwidthMeter):
+    """
+    Performs an HTTP transfer with aiohttp on a shared background event loop, counting the bytes as they're
+    sent & received. This avoids the cost of a separate curl process and of tracing all of its syscalls.
+    """
 
-        # Save the raw data to disk so we can use it again later if necessary.
-        # For example we might want to change the size of each tick,
-        # or we might find a bug in our processing code.
-        caller_name = get_calling_function_name()
-        time_label = datetime.now(tz=timezone.utc).strftime("%Y-%m-%d--%H-%M-%S.%f")
-        with open(f"{time_label}_{caller_name}_{self.label}.out.txt", "w") as outfile:
-            outfile.write(self.stdout_accumulator)
-        with open(f"{time_label}_{caller_name}_{self.label}.err.txt", "w") as outfile:
-            outfile.write(self.stderr_accumulator)
-
-        transmit_regex = re.compile(
-            r"^(\d+\.\d+) (sendto|send|recvfrom|recv)\(.*\) = (\d+)$"
+    _loop: "asyncio.AbstractEventLoop | None" = None
+
+    def __init__(
+        self,
+        url: str,
+        headers: dict[str, str],
+        upload_path: "str | None" = None,
+        label: "str | None" = None,
+    ):
+        super().__init__(label)
+        self.future = asyncio.run_coroutine_threadsafe(
+            self._transfer(url, headers, upload_path), self._event_loop()
         )
-        send_accumulator = 0
-        recv_accumulator = 0
-        first_tick: Optional[int] = None
-        previous_tick: Optional[int] = None
-        if initial_timestamp is not None:
-            first_tick = time2tick(initial_timestamp)
-            previous_tick = first_tick
-        send_bursts = []
-        recv_bursts = []
-        assert self.process_handle.poll() is not None
-        for line_index, line in enumerate(self.stderr_accumulator.splitlines()):
-            match = re.match(transmit_regex, line)
-            if match is not None:
-                timestamp = match.group(1)
-                syscall = match.group(2)
-                num_bytes = int(match.group(3))
-
-                is_send = syscall.startswith("send")
-                if first_tick is None:
-                    first_tick = time2tick(float(timestamp))
-                    previous_tick = time2tick(first_tick)
-                assert previous_tick is not None
-
-                new_tick = time2tick(float(timestamp))
-                if new_tick != previous_tick:
-                    prev_time = tick2time(previous_tick - first_tick)
-                    send_bursts.append((prev_time, burst2mbps(send_accumulator)))
-                    recv_bursts.append((prev_time, burst2mbps(recv_accumulator)))
-                    send_accumulator = 0
-                    recv_accumulator = 0
-
-                    # Fill in zeroes for any intervening ticks that had no transmissions
-                    for tick in range(previous_tick + 1, new_tick):
-                        ticktime = tick2time(tick - first_tick)
-                        send_bursts.append((ticktime, 0))
-                        recv_bursts.append((ticktime, 0))
-                    previous_tick = new_tick
-
-                if is_send:
-                    send_accumulator += num_bytes
-                else:
-                    recv_accumulator += num_bytes
-
-        if (previous_tick is not None) and (first_tick is not None):
-            last_time = tick2time(previous_tick - first_tick)
-        else:
-            last_time = 0
-        if send_accumulator != 0:
-            send_bursts.append((last_time, burst2mbps(send_accumulator)))
-        if recv_accumulator != 0:
-            recv_bursts.append((last_time, burst2mbps(recv_accumulator)))
-        return (send_bursts, recv_bursts)
+
+    @classmethod
+    def _event_loop(cls) -> asyncio.AbstractEventLoop:
+        if cls._loop is None:
+            cls._loop = asyncio.new_event_loop()
+            threading.Thread(target=cls._loop.run_forever, daemon=True).start()
+        return cls._loop
+
+    async def _transfer(
+        self, url: str, headers: dict[str, str], upload_path: "str | None"
+    ) -> None:
+        # Like the curl commands this replaces, don't time out: throttled transfers can take a while
+        async with aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=None)
+        ) as session:
+            if upload_path is None:
+                request = session.get(url, headers=headers)
+            else:
+                request = session.post(
+                    url, headers=headers, data=self._read_upload(upload_path)
+                )
+            async with request as response:
+                async for chunk in response.content.iter_chunked(TRANSFER_CHUNK_SIZE):
+                    self.recv_per_tick[time2tick(time.time())] += len(chunk)
+
+    async def _read_upload(self, upload_path: str) -> AsyncIterator[bytes]:
+        with open(upload_path, "rb") as upload:
+            while chunk := upload.read(TRANSFER_CHUNK_SIZE):
+                # We count the data as sent once aiohttp asks for it, which is when the socket can accept more
+                self.send_per_tick[time2tick(time.time())] += len(chunk)
+                yield chunk
+
+    def has_terminated(self) -> bool:
+        return self.future.done()
+
+    def has_finished(self) -> bool:
+        return self.has_terminated()
+
+    def _failure(self) -> "BaseException | None":
+        # Asking a cancelled future for its exception raises CancelledError rather than returning it
+        if self.future.cancelled():
+            return asyncio.CancelledError()
+        return self.future.exception()
+
+    def returncode(self) -> int:
+        return 0 if self._failure() is None else 1
+
+    def print_failure(self) -> None:
+        print(f"Transfer failed with: {self._failure()!r}")
+
+
+def download(
+    data: str, server: int, user: int, label: "str | None" = None
+) -> BandwidthMeter:
+    if TRANSFER_DRIVER == "aiohttp":
+        headers = {"Authorization": auth_header(user)}
+        return InProcessTransfer(server_url(server, data), headers, label=label)
+    return BandwidthTracingProcess(
+        get_cmd(data, server, user), label, caller_name=get_calling_function_name()
+    )
+
+
+def upload(
+    data_quantity: str, server: int, user: int, label: "str | None" = None
+) -> BandwidthMeter:
+    if TRANSFER_DRIVER == "aiohttp":
+        headers = {"Authorization": auth_header(user)}
+        path = upload_file(data_quantity)
+        return InProcessTransfer(server_url(server), headers, path, label)
+    return BandwidthTracingProcess(
+        post_cmd(data_quantity, server, user),
+        label,
+        caller_name=get_calling_function_name(),
+    )
+
+
+def accumulate_output(timeout: float) -> None:
+    """
+    Wait up to `timeout` seconds for output from any of our traced processes and accumulate whatever is available.
+    Note that this reads from *all* live processes, not just the ones a given test happens to be waiting on.
+    """
+    for key, _ in BandwidthTracingProcess._SEL.select(timeout=timeout):
+        (proc, stream) = key.data
+        proc._drain(stream)
 
 
 def run_for_seconds(
-    seconds: float, procs_to_update: "Iterable[BandwidthTracingProcess]"
+    seconds: float, procs_to_update: "Iterable[BandwidthMeter]"
 ) -> bool:
-    start = datetime.now()
-    limit = timedelta(seconds=seconds)
-    while (datetime.now() - start) < limit:
-        for proc in procs_to_update:
-            proc.accumulate_output()
-        time.sleep(0.01)
+    deadline = time.monotonic() + seconds
+    remaining = seconds
+    while remaining > 0:
+        accumulate_output(min(remaining, SELECT_TIMEOUT_SECS))
+        remaining = deadline - time.monotonic()
     return any((p for p in procs_to_update if p.has_terminated()))
 
 
-def run_to_completion(
-    *procs: BandwidthTracingProcess,
-    also_update_procs: "Iterable[BandwidthTracingProcess] | None" = None,
-) -> None:
-    all_terminated = False
-    while not all_terminated:
-        all_terminated = True
-        for proc in procs:
-            proc.accumulate_output()
-            if not proc.has_terminated():
-                all_terminated = False
-        if also_update_procs is not None:
-            for proc in also_update_procs:
-                proc.accumulate_output()
-        time.sleep(0.01)
+def run_to_completion(*procs: BandwidthMeter) -> None:
+    while not all(proc.has_finished() for proc in procs):
+        accumulate_output(SELECT_TIMEOUT_SECS)
 
 
 def get_calling_function_name() -> str:
@@ -273,21 +589,20 @@ def align_timeseries(series: "Sequence[TransferSeries]") -> None:
     if any(len(s) == 0 for s in series):
         return  # We have empty series, so don't try to align them
 
-    min_start_tick = time2tick(min((s[0][0] for s in series)))
-    max_end_tick = time2tick(max((s[-1][0] for s in series)))
+    min_start_tick = time2tick(min((s.times[0] for s in series)))
+    max_end_tick = time2tick(max((s.times[-1] for s in series)))
     for s in series:
-        start_tick = time2tick(s[0][0])
-        end_tick = time2tick(s[-1][0])
-        prefix_ticks = [(tick2time(t), 0) for t in range(min_start_tick, start_tick)]
-        if len(prefix_ticks) > 0:
-            s.reverse()
-            prefix_ticks.reverse()
-            s.extend(prefix_ticks)
-            s.reverse()
-        suffix_ticks = [
-            (tick2time(t), 0) for t in range(end_tick + 1, max_end_tick + 1)
-        ]
-        s.extend(suffix_ticks)
+        start_tick = time2tick(s.times[0])
+        end_tick = time2tick(s.times[-1])
+        # Pad out each series with zeroes before & after so they all cover the same range of ticks
+        prefix_ticks = np.arange(min_start_tick, start_tick)
+        suffix_ticks = np.arange(end_tick + 1, max_end_tick + 1)
+        s.times = np.concatenate(
+            (prefix_ticks / TICKS_PER_SECOND, s.times, suffix_ticks / TICKS_PER_SECOND)
+        )
+        s.rates = np.concatenate(
+            (np.zeros(len(prefix_ticks)), s.rates, np.zeros(len(suffix_ticks)))
+        )
 
 
 def plot_series(
@@ -296,15 +611,14 @@ def plot_series(
     linestyle: str | None = None,
     print_stats: bool = True,
 ) -> None:
-    (xvals, yvals) = zip(*series)
     if print_stats:
         print(f"{label} stats:")
-        print(f"    Min = {min(yvals)}")
-        print(f"    Max = {max(yvals)}")
-        print(f"    Mean = {statistics.mean(yvals)}")
-        print(f"    Stddev = {statistics.pstdev(yvals)}")
+        print(f"    Min = {series.rates.min()}")
+        print(f"    Max = {series.rates.max()}")
+        print(f"    Mean = {series.rates.mean()}")
+        print(f"    Stddev = {series.rates.std()}")
 
-    plt.plot(xvals, yvals, label=label, linestyle=linestyle)
+    plt.plot(series.times, series.rates, label=label, linestyle=linestyle)
 
 
 def plot_series_sum(
@@ -314,7 +628,6 @@ def plot_series_sum(
     if len(series) == 0:
         return
 
-    summed: TransferSeries = []
     for series_index, s in enumerate(series):
         if len(s) != len(series[0]):
             print(
@@ -324,18 +637,19 @@ def plot_series_sum(
             print(f"Series {series_index}: {str(s)}")
             raise ValueError("Cannot sum series with different lengths")
 
-    for i in range(len(series[0])):
-        for check_series_index, check_series in enumerate(series):
-            if check_series[i][0] != series[0][i][0]:
-                print(
-                    f"ERROR: Cannot sum series {check_series_index} with mismatched timestamps @ "
-                    + f"index {i}: {check_series[i][0]} vs {series[0][i][0]}"
-                )
-                print(f"Series 0: {str(series[0])}")
-                print(f"Series {series_index}: {str(check_series)}")
-                raise ValueError("Cannot sum series with mismatched timestamps")
-        sum_val = sum((s[i][1] for s in series))
-        summed.append((series[0][i][0], sum_val))
+    # Compare each series' timestamps as a whole rather than element by element, and only go looking for where
+    # they differ when we have an error to report
+    for series_index, s in enumerate(series):
+        if not np.array_equal(s.times, series[0].times):
+            i = int(np.flatnonzero(s.times != series[0].times)[0])
+            print(
+                f"ERROR: Cannot sum series {series_index} with mismatched timestamps @ "
+                + f"index {i}: {s.times[i]} vs {series[0].times[i]}"
+            )
+            print(f"Series 0: {str(series[0])}")
+            print(f"Series {series_index}: {str(s)}")
+            raise ValueError("Cannot sum series with mismatched timestamps")
+    summed = TransferSeries(series[0].times, np.add.reduce([s.rates for s in series]))
     plot_series(summed, label, linestyle="--")
 
 
@@ -358,7 +672,7 @@ def test_single_download_request() -> None:
     """
     Expect to see the download bandwidth restricted to the configured limit.
     """
-    proc = BandwidthTracingProcess(get_cmd("100mb", server=1, user=1))
+    proc = download("100mb", server=1, user=1)
     run_to_completion(proc)
     (_, recv_rate) = proc.parse_network_stats()
 
@@ -371,7 +685,7 @@ def test_single_upload_request() -> None:
     """
     Expect to see the download bandwidth restricted to the configured limit.
     """
-    proc = BandwidthTracingProcess(post_cmd("50mb", server=1, user=1))
+    proc = upload("50mb", server=1, user=1)
     run_to_completion(proc)
     (send_rate, recv_rate) = proc.parse_network_stats()
 
@@ -381,8 +695,8 @@ def test_single_upload_request() -> None:
 
 
 def test_single_download_with_concurrent_single_upload() -> None:
-    proc_recv = BandwidthTracingProcess(get_cmd("100mb", server=1, user=1))
-    proc_send = BandwidthTracingProcess(post_cmd("50mb", server=1, user=1))
+    proc_recv = download("100mb", server=1, user=1)
+    proc_send = upload("50mb", server=1, user=1)
     run_to_completion(proc_recv, proc_send)
     (_, recv_rate) = proc_recv.parse_network_stats()
     (send_rate, _) = proc_send.parse_network_stats()
@@ -399,8 +713,8 @@ def test_two_concurrent_downloads_from_one_user_to_one_server() -> None:
     Expect each download to be restricted to roughly half of the configured limit.
     """
     start_timestamp = datetime.now().timestamp()
-    proc1 = BandwidthTracingProcess(get_cmd("100mb", server=1, user=1), "down1")
-    proc2 = BandwidthTracingProcess(get_cmd("100mb", server=1, user=1), "down2")
+    proc1 = download("100mb", server=1, user=1, label="down1")
+    proc2 = download("100mb", server=1, user=1, label="down2")
     run_to_completion(proc1, proc2)
     (_, proc1_recv) = proc1.parse_network_stats(start_timestamp)
     (_, proc2_recv) = proc2.parse_network_stats(start_timestamp)
@@ -418,8 +732,8 @@ def test_two_concurrent_downloads_from_two_users_to_one_server() -> None:
     """
     Expect each download to receive the full configured throughput limit of that user.
     """
-    proc1 = BandwidthTracingProcess(get_cmd("200mb", server=1, user=1), "down1")
-    proc2 = BandwidthTracingProcess(get_cmd("200mb", server=1, user=2), "down2")
+    proc1 = download("200mb", server=1, user=1, label="down1")
+    proc2 = download("200mb", server=1, user=2, label="down2")
     run_to_completion(proc1, proc2)
 
     (_, proc1_recv) = proc1.parse_network_stats()
@@ -439,8 +753,8 @@ def test_two_concurrent_downloads_from_one_user_to_two_servers() -> None:
     Expect each download to be restricted to roughly one third of the configured limit.
     """
     start_timestamp = datetime.now().timestamp()
-    proc1 = BandwidthTracingProcess(get_cmd("100mb", server=1, user=1), "down1")
-    proc2 = BandwidthTracingProcess(get_cmd("100mb", server=2, user=1), "down2")
+    proc1 = download("100mb", server=1, user=1, label="down1")
+    proc2 = download("100mb", server=2, user=1, label="down2")
     run_to_completion(proc1, proc2)
     (_, proc1_recv) = proc1.parse_network_stats(start_timestamp)
     (_, proc2_recv) = proc2.parse_network_stats(start_timestamp)
@@ -459,9 +773,9 @@ def test_three_concurrent_downloads_from_one_user_to_two_servers() -> None:
     Expect each download to be restricted to roughly one third of the configured limit.
     """
     start_timestamp = datetime.now().timestamp()
-    proc1 = BandwidthTracingProcess(get_cmd("100mb", server=1, user=1), "down1")
-    proc2 = BandwidthTracingProcess(get_cmd("100mb", server=2, user=1), "down2")
-    proc3 = BandwidthTracingProcess(get_cmd("50mb", server=2, user=1), "down3")
+    proc1 = download("100mb", server=1, user=1, label="down1")
+    proc2 = download("100mb", server=2, user=1, label="down2")
+    proc3 = download("50mb", server=2, user=1, label="down3")
     run_to_completion(proc1, proc2, proc3)
     (_, proc1_recv) = proc1.parse_network_stats(start_timestamp)
     (_, proc2_recv) = proc2.parse_network_stats(start_timestamp)
@@ -485,11 +799,11 @@ def test_large_request_with_concurrent_small_request_to_the_same_server() -> Non
     to the full throughput once the smaller download completes.
     """
     start_timestamp = datetime.now().timestamp()
-    proc1 = BandwidthTracingProcess(get_cmd("100mb", server=1, user=1))
+    proc1 = download("100mb", server=1, user=1)
     terminated_early = run_for_seconds(10, (proc1,))
-    proc2 = BandwidthTracingProcess(get_cmd("20mb", server=1, user=1))
+    proc2 = download("20mb", server=1, user=1)
 
-    run_to_completion(proc2, also_update_procs=(proc1,))
+    run_to_completion(proc2)
     terminated_early = terminated_early and proc1.has_terminated()
     run_to_completion(proc1)
 
@@ -513,12 +827,12 @@ def test_large_request_with_concurrent_small_request_to_a_different_server() ->
     to the full throughput once the smaller download completes.
     """
     start_timestamp = datetime.now().timestamp()
-    proc1 = BandwidthTracingProcess(get_cmd("200mb", server=1, user=1))
+    proc1 = download("200mb", server=1, user=1)
     run_for_seconds(10, (proc1,))
     terminated_early = proc1.has_terminated()
-    proc2 = BandwidthTracingProcess(get_cmd("50mb", server=2, user=1))
+    proc2 = download("50mb", server=2, user=1)
 
-    run_to_completion(proc2, also_update_procs=(proc1,))
+    run_to_completion(proc2)
     terminated_early = terminated_early and proc1.has_terminated()
     run_to_completion(proc1)
 
@@ -558,9 +872,9 @@ def test_many_small_requests_in_series_to_the_same_server() -> None:
 def test_many_small_requests_in_parallel_to_the_same_server() -> None:
     start_timestamp = datetime.now().timestamp()
     num_requests = 40
-    requests: list[BandwidthTracingProcess] = []
+    requests: list[BandwidthMeter] = []
     for i in range(num_requests):
-        requests.append(BandwidthTracingProcess(get_cmd("512kb", server=1, user=1)))
+        requests.append(download("512kb", server=1, user=1))
         run_for_seconds(0.01, requests)
 
     run_to_completion(*requests)
@@ -580,7 +894,7 @@ def test_many_small_requests_in_parallel_to_the_same_server() -> None:
 # NOTE: This test should be run against a polygen instance where the user's GET request limit is at least 20/s
 def test_large_request_with_bursts_of_concurrent_small_requests() -> None:
     start_timestamp = datetime.now().timestamp()
-    proc1 = BandwidthTracingProcess(get_cmd("80mb", server=1, user=1))
+    proc1 = download("80mb", server=1, user=1)
     run_for_seconds(10, (proc1,))
 
     all_small_recv_stats: list[TransferSeries] = []
@@ -589,10 +903,10 @@ def test_large_request_with_bursts_of_concurrent_small_requests() -> None:
     small_requests_per_burst = 10
     for i in range(burst_repeats):
         small_requests = [
-            BandwidthTracingProcess(get_cmd("256kb", server=1, user=1))
+            download("256kb", server=1, user=1)
             for i in range(small_requests_per_burst)
         ]
-        run_to_completion(*small_requests, also_update_procs=(proc1,))
+        run_to_completion(*small_requests)
         all_small_recv_results += (proc.returncode() for proc in small_requests)
         all_small_recv_stats += [
             proc.parse_network_stats(start_timestamp)[1] for proc in small_requests
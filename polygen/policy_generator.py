@@ -3,25 +3,35 @@
 from __future__ import annotations
 
 import argparse
+import asyncio
+import collections
+import dataclasses
 import errno
 import functools
-import json
+import io
+import itertools
 import logging
 import logging.handlers
+import multiprocessing
+import multiprocessing.process
+import multiprocessing.queues
+import multiprocessing.sharedctypes
 import os
 import queue
+import re
+import selectors
+import signal
 import socket
-import statistics
 import sys
 import threading
 import time
 import warnings
-from collections.abc import Callable
+from collections.abc import Callable, Mapping, Sequence
 from concurrent import futures
 from dataclasses import dataclass
-from enum import Enum
+from enum import IntEnum
 from hashlib import sha1
-from typing import Any, Iterable, NamedTuple
+from typing import Any, Iterable, NamedTuple, Protocol
 
 import redis
 import yaml
@@ -33,6 +43,12 @@ from weir.models.user_metrics import (
 from weir.models.violations import Violations
 from weir.services.metric_service import MetricService
 
+try:
+    # orjson parses the limits file several times faster than json, so use it when it is available
+    from orjson import loads as json_loads  # type: ignore
+except ImportError:
+    from json import loads as json_loads
+
 MB = 1048576  # 1024*1024
 
 RELOAD_FIFO_NAME = "polygen_reload.fifo"
@@ -42,6 +58,8 @@ DEFAULT_QOS_ID = "common"
 
 REDIS_KEY_TYPE_VERB = "verb"
 REDIS_KEY_TYPE_CONN = "conn"
+# Alongside the check loop for each of the key types above, the worker process that computes limit shares
+WORKER_DEMAND = "demand"
 
 QOS_VERB_LIMIT_NOT_CONFIGURED = -1
 DEFAULT_VERB_RATE_LIMIT_IF_QOS_IS_NOT_CONFIGURED = 1000  # requests/sec
@@ -51,11 +69,24 @@ VERB_LIMITING_BANDWIDTH_CATEGORY_PATTERN = "_bnd_"
 AREQ_LIMITING_CATEGORY_PATTERN = "_conns"
 
 MAX_LOG_FILE_BYTES = 100 * MB
-USECS_IN_SEC = 1_000_000
+NSECS_IN_USEC = 1000
+NSECS_IN_SEC = 1_000_000_000
 MSECS_IN_SEC = 1000
 
+# Maximum number of (category, user) limit lookups to remember between limit reloads
+LIMIT_CACHE_SIZE = 50_000
+
+# Matches a conn_v2 key, e.g. conn_v2_user_up_instance1234_AKIAIOSFODNN7EXAMPLE$dev.dc,
+# capturing its direction, instance ID and user key
+_CONN_V2_KEY_RE = re.compile(r"conn_v2_[^_]*_([^_]*)_([^_]*)_([^_$]*)[^_]*")
+
+# Maps the path of a Lua script to its contents and SHA1, so that each script is only read and hashed once
+_LUA_SCRIPT_CACHE: dict[str, tuple[str, str]] = {}
 
-class Direction(Enum):
+
+# An IntEnum so that its members hash like ints, in C, rather than through Enum.__hash__ in Python,
+# which makes DemandKey (a tuple containing one) cheaper to hash too
+class Direction(IntEnum):
     Up = 1
     Down = 2
 
@@ -72,15 +103,58 @@ class Direction(Enum):
         return "up" if self == Direction.Up else "dwn"
 
 
+# Lets aggregate_demand_from_conn_v2 find the direction for each key with a single dict lookup,
+# rather than a call to Direction.from_str
+_DIRECTIONS_BY_STR = {str(direction): direction for direction in Direction}
+# The limit category for the bandwidth in each direction, so we don't format one for every user we share limits for
+_BANDWIDTH_LIMIT_CATEGORIES = {
+    direction: f"user_bnd_{direction}" for direction in Direction
+}
+# The usages _check_all_conn_key_violations reports for every user it blocks or unblocks
+_REQUESTS_BLOCK = UsageValue.REQUESTS_BLOCK
+_REQUESTS_UNBLOCK = UsageValue.REQUESTS_UNBLOCK
+
+
 class DemandKey(NamedTuple):
     user_key: str
     direction: Direction
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LimitConfig:
     user_to_qos_id: dict[str, str]
     qos: dict[str, dict[str, float]]
+    # The limits configured for each (user key, cat(egory)), with each user's QoS ID already resolved
+    configured_limits: dict[tuple[str, str], float] = dataclasses.field(
+        init=False, repr=False, compare=False
+    )
+    # The limits of the default policy for each cat(egory)
+    default_limits: dict[str, float] = dataclasses.field(
+        init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        # Limits that aren't configured are left out so looking them up falls through to the next level
+        def configured(qos_id: str) -> dict[str, float]:
+            qos_id_limits = self.qos.get(qos_id)
+            if isinstance(qos_id_limits, dict):
+                return {
+                    cat: limit
+                    for cat, limit in qos_id_limits.items()
+                    if limit != QOS_VERB_LIMIT_NOT_CONFIGURED
+                }
+            return {}
+
+        configured_limits = {
+            (key, cat): limit
+            for key, qos_id in self.user_to_qos_id.items()
+            if qos_id and isinstance(qos_id, str)
+            for cat, limit in configured(qos_id).items()
+        }
+        default_policy_name = self.user_to_qos_id.get(DEFAULT_QOS_ID, "DEFAULT")
+        # The config never changes once loaded, so its lookup tables can be built up front
+        object.__setattr__(self, "configured_limits", configured_limits)
+        object.__setattr__(self, "default_limits", configured(default_policy_name))
 
 
 # This maps a (user-access-key, transfer-direction) tuple to:
@@ -94,11 +168,39 @@ DemandMap = dict[DemandKey, dict[str, int]]
 HaproxyServerMap = dict[str, list["HaproxyServer"]]
 
 
+class PolicyQueue(Protocol):
+    def add_message(self, message: bytes) -> None:
+        pass
+
+
+# What Policies.prepare_message hands each endpoint's policies to: either the haproxies themselves,
+# or a PolicyRelay per endpoint that passes them on to the main process to send
+PolicyQueueMap = Mapping[str, Sequence[PolicyQueue]]
+
+
+class PolicyMessage(NamedTuple):
+    endpoint: str
+    message: bytes
+
+
+class UnknownUsersReport(NamedTuple):
+    users: set[str]
+
+
+# What the worker processes pass to the main process, for it to send on to the haproxies or report for them
+WorkerMessage = PolicyMessage | UnknownUsersReport
+
+
 def init_logger(
-    logger_name: str, backup_count: int, logger_file: str | None, log_level: str
+    logger_name: str,
+    backup_count: int,
+    logger_file: str | None,
+    log_level: str,
+    log_queue: multiprocessing.queues.Queue[logging.LogRecord] | None = None,
 ) -> logging.Logger:
     """
     General log setup.
+    When given a log_queue, log records are passed on to whoever is listening to it, rather than being written out.
     """
     root_logger = logging.getLogger()
     try:
@@ -107,9 +209,16 @@ def init_logger(
         root_logger.setLevel("DEBUG")
 
     log_formatter = logging.Formatter(
-        "%(asctime)s - [%(threadName)s] - %(levelname)s - %(message)s"
+        "%(asctime)s - [%(processName)s/%(threadName)s] - %(levelname)s - %(message)s"
     )
-    if (logger_file is not None) and len(logger_file):
+    if log_queue is not None:
+        # Only the main process writes to the log file, so that there's only ever one of us rotating it.
+        # Drop any handlers we inherited from it when it forked us.
+        for handler in root_logger.handlers[:]:
+            root_logger.removeHandler(handler)
+            handler.close()
+        root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    elif (logger_file is not None) and len(logger_file):
         file_handler = logging.handlers.RotatingFileHandler(
             logger_file, maxBytes=MAX_LOG_FILE_BYTES, backupCount=backup_count
         )
@@ -128,6 +237,21 @@ def init_logger(
     return my_logger
 
 
+def record_run_time(
+    avg_run_time_list: list[float],
+    sample_size: int,
+    zone: str,
+    logger: logging.Logger,
+    func_name: str,
+    run_time: float,
+) -> None:
+    if len(avg_run_time_list) >= sample_size:
+        avg_time = str(int(sum(avg_run_time_list) / len(avg_run_time_list)))
+        logger.info(f"zone={zone} func={func_name} average_time={avg_time}")
+        avg_run_time_list.clear()
+    avg_run_time_list.append(run_time)
+
+
 def avg_time[R, **P](
     avg_run_time_list: list[float],
     sample_size: int,
@@ -138,15 +262,21 @@ def avg_time[R, **P](
     def decorator_action(func: Callable[P, R]) -> Callable[P, R]:
         @functools.wraps(func)
         def wrapper_action(*args: P.args, **kwargs: P.kwargs) -> R:
-            if len(avg_run_time_list) >= sample_size:
-                avg_time = str(int(statistics.mean(avg_run_time_list)))
-                logger.info(f"zone={zone} func={func.__name__} average_time={avg_time}")
-                avg_run_time_list.clear()
-            time_in_microsecs_begin = int(time.time() * USECS_IN_SEC)
+            # Use the monotonic clock, so wall-clock adjustments don't skew our timings
+            time_in_nanosecs_begin = time.perf_counter_ns()
             ret = func(*args, **kwargs)
-            time_in_microsecs_end = int(time.time() * USECS_IN_SEC)
-            total_run_time = time_in_microsecs_end - time_in_microsecs_begin
-            avg_run_time_list.append(total_run_time / num)
+            time_in_nanosecs_end = time.perf_counter_ns()
+            total_run_time = (
+                time_in_nanosecs_end - time_in_nanosecs_begin
+            ) // NSECS_IN_USEC
+            record_run_time(
+                avg_run_time_list,
+                sample_size,
+                zone,
+                logger,
+                func.__name__,
+                total_run_time / num,
+            )
             return ret
 
         return wrapper_action
@@ -155,7 +285,15 @@ def avg_time[R, **P](
 
 
 class HaproxyServer:
-    queue: queue.Queue[str]
+    # Messages are added to the queue from the violation-check threads and sent from the event loop of
+    # the send_policy thread. We rely on deque's append/popleft being atomic rather than needing a lock for it.
+    queue: collections.deque[bytes]
+
+    # Framing around each batch of policies we send, which haproxy uses to find where the batch starts and ends
+    POLICIES_HEADER = b"policies\n"
+    POLICIES_FOOTER = b"\nEND_OF_POLICIES\n"
+
+    MAX_SEND_POLICY_TRIES = 2
 
     def __init__(
         self,
@@ -174,31 +312,52 @@ class HaproxyServer:
         self.port = port
         self.sleep_time_milliseconds = sleep_time_milliseconds
         self.queue_max_size = queue_size
-        self.queue = queue.Queue(maxsize=queue_size)
+        self.queue = collections.deque()
+        # Used by the blocking _send_policies
         self.haproxy_connection: socket.socket | None = None
+        # Used by run, which sends the queued policies from an asyncio event loop
+        self.haproxy_writer: asyncio.StreamWriter | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        # Set by stop, from any thread, to have run return once it has finished its current send
+        self._stop = threading.Event()
 
     def _establish_new_haproxy_connection(self, remote_addr: tuple[str, int]) -> None:
         if self.haproxy_connection is not None:
             self.haproxy_connection.close()
         self.haproxy_connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.haproxy_connection.connect(remote_addr)
+        # Policies are time-sensitive and we already batch them up ourselves before each send,
+        # so don't let Nagle's algorithm hold them back waiting for more data
+        self.haproxy_connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.logger.debug(f"Successfully connected to haproxy @ {remote_addr}")
+
+    async def _establish_new_haproxy_stream(self, remote_addr: tuple[str, int]) -> None:
+        if self.haproxy_writer is not None:
+            self.haproxy_writer.close()
+            self.haproxy_writer = None
+        # asyncio sets TCP_NODELAY on TCP connections for us
+        _, self.haproxy_writer = await asyncio.open_connection(*remote_addr)
         self.logger.debug(f"Successfully connected to haproxy @ {remote_addr}")
 
-    def _send_policies(self, message: str) -> None:
+    def _send_policies(self, message: bytes) -> None:
         if len(message) <= 0:
             return
         remote: tuple[str, int] = (self.host, self.port)
-        self.logger.debug(
-            f"Sending policies to endpoint {self.endpoint} haproxy {remote} message: {message}"
-        )
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                "Sending policies to endpoint %s haproxy %s message: %r",
+                self.endpoint,
+                remote,
+                message,
+            )
         try_count: int = 0
-        max_send_policy_tries: int = 2
-        while try_count < max_send_policy_tries:
+        while try_count < self.MAX_SEND_POLICY_TRIES:
             try_count += 1
             try:
                 if self.haproxy_connection is None or try_count > 1:
                     self._establish_new_haproxy_connection(remote)
-                self.haproxy_connection.sendall(message.encode())  # type: ignore
+                self.haproxy_connection.sendall(message)  # type: ignore
             except OSError as se:  # log and retry if a socket error is received
                 self.logger.warning(
                     f"Error on {try_count} attempted connections to {remote}: {se}"
@@ -211,62 +370,128 @@ class HaproxyServer:
             else:  # success
                 return
         self.logger.error(
-            f"Exhausted all {max_send_policy_tries} retries connection to {remote}"
+            f"Exhausted all {self.MAX_SEND_POLICY_TRIES} retries connection to {remote}"
         )
 
-    def add_message(self, message: str) -> None:
-        try:
-            self.queue.put(message, block=False)
-        except queue.Full:
+    async def _send_policies_async(self, message: bytes) -> None:
+        remote: tuple[str, int] = (self.host, self.port)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                "Sending policies to endpoint %s haproxy %s message: %r",
+                self.endpoint,
+                remote,
+                message,
+            )
+        try_count: int = 0
+        while try_count < self.MAX_SEND_POLICY_TRIES:
+            try_count += 1
+            try:
+                if self.haproxy_writer is None or try_count > 1:
+                    await self._establish_new_haproxy_stream(remote)
+                assert self.haproxy_writer is not None
+                self.haproxy_writer.write(message)
+                await self.haproxy_writer.drain()
+            except OSError as se:  # log and retry if a socket error is received
+                self.logger.warning(
+                    f"Error on {try_count} attempted connections to {remote}: {se}"
+                )
+            except Exception as e:  # no retry
+                self.logger.exception(
+                    f"_send_policies had exception on remote {remote}, except: {e}"
+                )
+                return
+            else:  # success
+                return
+        self.logger.error(
+            f"Exhausted all {self.MAX_SEND_POLICY_TRIES} retries connection to {remote}"
+        )
+
+    def add_message(self, message: bytes) -> None:
+        if 0 < self.queue_max_size <= len(self.queue):
             self.logger.error(
                 f"Policy message queue for haproxy server {(self.host, self.port)} "
-                f"is full! size: {self.queue.qsize()}, "
+                f"is full! size: {len(self.queue)}, "
                 f"max queue size: {self.queue_max_size}"
             )
+            return
+        self.queue.append(message)
+        self._wake_up()
+
+    def _wake_up(self) -> None:
+        # We're called from other threads, so have the event loop wake up run for us
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake_up()
 
-    def run(self) -> None:
+    async def run(self) -> None:
         self.logger.info(
-            f"Start send_policies thread for haproxy_server: {(self.host, self.port)}"
+            f"Start sending policies to haproxy_server: {(self.host, self.port)}"
         )
         avg_send_policy_run_time_list: list[float] = []
 
-        @avg_time(avg_send_policy_run_time_list, 100, self.zone, self.logger, 1)
-        def send_policy_to_haproxy(message: str) -> None:
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        # Anything queued before we were ready to be woken up would otherwise sit there until the next message
+        if len(self.queue) > 0:
+            self._wakeup.set()
+
+        while not self._stop.is_set():
+            await self._wakeup.wait()
+            # Clear before draining, so that anything added while we drain will wake us up again
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break
+
+            # Coalesce everything that was queued up since our last send into a single write
+            messages: list[bytes] = []
             while True:
                 try:
-                    message += self.queue.get(block=False)
-                except queue.Empty:
-                    if message and message != "":
-                        self._send_policies(
-                            "".join(("policies\n", message, "\nEND_OF_POLICIES\n"))
-                        )
-                        message = ""
+                    messages.append(self.queue.popleft())
+                except IndexError:
                     break
+            if any(messages):
+                time_in_nanosecs_begin = time.perf_counter_ns()
+                try:
+                    # Each message is one or more policy lines, so they need to be separated by newlines too
+                    await self._send_policies_async(
+                        b"".join(
+                            (
+                                self.POLICIES_HEADER,
+                                b"\n".join(messages),
+                                self.POLICIES_FOOTER,
+                            )
+                        )
+                    )
                 except Exception as e:
                     self.logger.warning(f"HaproxyServer had exception, except: {e}")
+                time_in_nanosecs_end = time.perf_counter_ns()
+                record_run_time(
+                    avg_send_policy_run_time_list,
+                    100,
+                    self.zone,
+                    self.logger,
+                    "send_policy_to_haproxy",
+                    (time_in_nanosecs_end - time_in_nanosecs_begin) // NSECS_IN_USEC,
+                )
 
-                self.queue.task_done()
-
-        while True:
-            try:
-                message: str = self.queue.get(block=True)
-                send_policy_to_haproxy(message)
-            except Exception as e:
-                self.logger.warning(f"HaproxyServer had exception, except: {e}")
-            finally:
-                self.queue.task_done()
-
-            time.sleep((self.sleep_time_milliseconds / 2) * 0.001)
+            await asyncio.sleep((self.sleep_time_milliseconds / 2) * 0.001)
 
 
 class Policies:
     def __init__(self, logger: logging.Logger) -> None:
         self.logger = logger
         self.epoch = 0
+        # The earliest time that's part of the epoch after the current one, so that checking whether a violation
+        # belongs to a new epoch is a single comparison rather than needing to convert its time to whole seconds
+        self.next_epoch_start = 1
         self.violations = Violations()
 
     def new_epoch(self, epoch_time: float) -> None:
         self.epoch = int(epoch_time)
+        self.next_epoch_start = self.epoch + 1
         self.violations = Violations()
 
     def add_violation(
@@ -276,14 +501,29 @@ class Policies:
         verb: UsageValue,
         diff_ratio: float = 1.0,
     ) -> None:
-        epoch_sec = int(epoch_time)
-        if epoch_sec > self.epoch:
+        if epoch_time >= self.next_epoch_start:
             self.new_epoch(epoch_time)
 
         self.violations.add_violation(metric, verb, diff_ratio)
 
+    def add_violations(
+        self,
+        epoch_time: float,
+        violations: Iterable[tuple[UserLevelUsage, UsageValue, float]],
+    ) -> None:
+        """
+        Adds a batch of (metric, verb, diff_ratio) violations that all happened at the same time,
+        only checking once whether they start a new epoch.
+        """
+        if epoch_time >= self.next_epoch_start:
+            self.new_epoch(epoch_time)
+
+        add_violation = self.violations.add_violation
+        for metric, verb, diff_ratio in violations:
+            add_violation(metric, verb, diff_ratio)
+
     def prepare_message(
-        self, haproxy_servers_map: HaproxyServerMap, epoch_time: float
+        self, haproxy_servers_map: PolicyQueueMap, epoch_time: float
     ) -> None:
         # message example:
         # Note: 1554317654056379 is the epoch in usec resolution (i.e., 1554317654.056379)
@@ -294,22 +534,39 @@ class Policies:
                 continue
 
             messages = self.violations.generate_violation_message(endpoint, epoch_time)
-            for message in messages:
-                self.logger.info(f"Violation message: {message}")
-                for server in haproxy_servers_map[endpoint]:
-                    server.add_message(message)
+            if len(messages) == 0:
+                continue
+            if self.logger.isEnabledFor(logging.INFO):
+                for message in messages:
+                    self.logger.info("Violation message: %s", message)
+
+            # Hand each server all of this endpoint's violations in one go, rather than queueing them one at a time,
+            # and only encode them once for all of those servers
+            endpoint_message = "\n".join(messages).encode()
+            for server in haproxy_servers_map[endpoint]:
+                server.add_message(endpoint_message)
 
 
 class UnknownUsers:
-    def __init__(self, report_time_seconds: int, logger: logging.Logger):
+    def __init__(
+        self,
+        report_time_seconds: int,
+        logger: logging.Logger,
+        forward_to: multiprocessing.queues.Queue[WorkerMessage] | None = None,
+    ):
         self.users: set[str] = set()
         self.report_time_seconds = report_time_seconds
         self.logger = logger
+        # In the worker processes, we pass our users on to the main process to report along with everyone else's
+        self.forward_to = forward_to
         self.last_report_time_seconds = 0
 
     def add(self, user: str) -> None:
         self.users.add(user)
 
+    def update(self, users: Iterable[str]) -> None:
+        self.users.update(users)
+
     def report(self) -> None:
         if self.report_time_seconds <= 0:
             return
@@ -317,28 +574,204 @@ class UnknownUsers:
         if now - self.last_report_time_seconds > self.report_time_seconds:
             self.last_report_time_seconds = now
             if len(self.users) > 0:
-                self.logger.warning(f"Users with no QoS limits:{self.users}")
+                if self.forward_to is not None:
+                    self.forward_to.put(UnknownUsersReport(self.users))
+                else:
+                    self.logger.warning(f"Users with no QoS limits:{self.users}")
                 self.users = set()
 
 
+class PolicyRelay:
+    """
+    Stands in for the haproxies on an endpoint in the worker processes,
+    passing their policies on to the main process to send.
+    """
+
+    def __init__(
+        self, endpoint: str, forward_to: multiprocessing.queues.Queue[WorkerMessage]
+    ) -> None:
+        self.endpoint = endpoint
+        self.forward_to = forward_to
+
+    def add_message(self, message: bytes) -> None:
+        # multiprocessing's Queue is thread-safe, so each of the violation-check threads can put to it directly
+        self.forward_to.put(PolicyMessage(self.endpoint, message))
+
+
+class PolicySender:
+    """
+    Sends the policies from every worker process on to the haproxies, from the main process,
+    so that there's only the one connection to each haproxy however many workers there are.
+    """
+
+    def __init__(self, logger: logging.Logger, config: dict[str, Any]) -> None:
+        self.logger = logger
+        self.haproxies, self.haproxies_map = get_haproxies_from_config(logger, config)
+
+        # thread for sending policies, which serves all haproxies from one event loop.
+        # It's a daemon so that it never holds up the process exiting, and any exception that
+        # escapes it is reported against its name by threading.excepthook rather than being lost.
+        self.send_policies_thread = threading.Thread(
+            target=asyncio.run,
+            args=(self._send_policies(),),
+            name="send_policy",
+            daemon=True,
+        )
+        self.send_policies_thread.start()
+        self.logger.info(
+            f"Send_policy thread created for {len(self.haproxies)} haproxies."
+        )
+
+    async def _send_policies(self) -> None:
+        await asyncio.gather(
+            *(haproxy_server.run() for haproxy_server in self.haproxies)
+        )
+
+    def add_message(self, endpoint: str, message: bytes) -> None:
+        if endpoint not in self.haproxies_map:
+            self.logger.warning(f"Invalid endpoint: {endpoint}")
+            return
+        for server in self.haproxies_map[endpoint]:
+            server.add_message(message)
+
+
+class ReloadFifo:
+    """
+    The FIFO file that users write "reload_limits" to, to trigger the limits reload for a specific zone.
+    example command:
+    echo "reload_limits" > /tmp/weir_dev_polygen_reload.fifo
+    """
+
+    def __init__(self, logger: logging.Logger, fifo_path: str) -> None:
+        self.logger = logger
+        self.fifo_path = fifo_path
+        self.make_fifo(fifo_path)
+        self.selector = selectors.DefaultSelector()
+        self._open()
+
+    @staticmethod
+    def make_fifo(fifo_path: str) -> None:
+        try:
+            os.mkfifo(fifo_path)
+            os.chmod(fifo_path, 0o666)
+        except OSError as e:
+            os.chmod(fifo_path, 0o666)
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _open(self) -> None:
+        # We open the FIFO non-blocking so that we don't have to wait for a writer to turn up,
+        # and can instead just check it for requests whenever we're ready to
+        self.fd = os.open(self.fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+        self.selector.register(self.fd, selectors.EVENT_READ)
+        self.logger.info("Reload FIFO opened")
+
+    def check(self) -> bool:
+        """
+        Returns whether we've been asked to reload the limits since we last checked.
+        """
+        reload_requested = False
+        for _ in self.selector.select(timeout=0):
+            data = os.read(self.fd, 4096)
+            if len(data) == 0:
+                # Once the writer has gone the FIFO will stay readable (at EOF) until we re-open it
+                self.logger.info("Writer closed the FIFO")
+                self.selector.unregister(self.fd)
+                os.close(self.fd)
+                self._open()
+            elif RELOAD_LIMITS_REQ in data.decode(errors="replace").split():
+                self.logger.info("Receive FIFO reload_limits request.")
+                reload_requested = True
+        return reload_requested
+
+
+def load_config(config_file: str) -> dict[str, Any]:
+    try:
+        with open(config_file) as f:
+            config = yaml.safe_load(f)
+    except yaml.YAMLError as e:
+        # We need the config to setup the logger, so we have to rely on `print` instead here
+        print(f"YAML error: {e}")
+        raise
+    except OSError:
+        print(f"Could not open/load config file {config_file}")
+        raise
+    return config
+
+
+def get_haproxies_from_config(
+    logger: logging.Logger, config: dict[str, Any]
+) -> tuple[list[HaproxyServer], HaproxyServerMap]:
+    haproxies: list[HaproxyServer] = []
+    haproxies_map: HaproxyServerMap = {}
+    for endpoint in config["haproxy_servers"]:
+        for k in config["haproxy_servers"][endpoint]:
+            items = k.strip().split(":")
+            if len(items) == 2:
+                haproxy_server = HaproxyServer(
+                    logger,
+                    config["zone"],
+                    endpoint,
+                    items[0],
+                    int(items[1]),
+                    config["sleep_time"],
+                    config["policy_msg_queue_size"],
+                )
+                haproxies.append(haproxy_server)
+
+                if endpoint not in haproxies_map:
+                    haproxies_map[endpoint] = []
+                haproxies_map[endpoint].append(haproxy_server)
+
+                logger.info(
+                    f"Haproxy machine for endpoint {endpoint} - {items[0]}:{items[1]}"
+                )
+    return haproxies, haproxies_map
+
+
+def reload_fifo_path(zone: str) -> str:
+    return os.path.join("/tmp", "_".join(("weir", zone, RELOAD_FIFO_NAME)))
+
+
 class PolicyGenerator:
-    def __init__(self, config_file: str) -> None:
+    # Each loop runs in its own worker process with its own PolicyGenerator. The main process reads
+    # reload requests from the FIFO, and bumps this shared count to let all of the workers know to reload their limits
+    limits_generation: multiprocessing.sharedctypes.Synchronized[int] | None = None
+    # The value of limits_generation when we last loaded our limits
+    loaded_limits_generation: int = 0
+
+    def __init__(
+        self,
+        config_file: str,
+        limits_generation: multiprocessing.sharedctypes.Synchronized[int] | None = None,
+        worker_messages: multiprocessing.queues.Queue[WorkerMessage] | None = None,
+        log_queue: multiprocessing.queues.Queue[logging.LogRecord] | None = None,
+        checks_violations: bool = True,
+    ) -> None:
+        """
+        worker_messages is where we pass our policies and unknown users on to the main process,
+        and log_queue where we pass our log records on to it.
+        checks_violations is False for the demand worker, which doesn't need anything for checking violations.
+        """
         self.config_file = config_file
-        self.config = self._load_config(config_file)
+        self.limits_generation = limits_generation
+        if limits_generation is not None:
+            self.loaded_limits_generation = limits_generation.value
+        self.config = load_config(config_file)
         self.logger = init_logger(
             "policy_generator",
             10,
             self.config.get("log_file_name", None),
             self.config["log_level"],
+            log_queue,
         )
         self.logger.info(f"Config file {config_file} loaded.")
         report_time_seconds = self.config.get("unknown_users_report_time_seconds", 60)
-        self.unknown_users = UnknownUsers(report_time_seconds, self.logger)
+        self.unknown_users = UnknownUsers(
+            report_time_seconds, self.logger, worker_messages
+        )
         self.sleep_time_milliseconds = self.config["sleep_time"]
         self.zone = self.config["zone"]
-        self.haproxies, self.haproxies_map = self._get_haproxies_from_config(
-            self.config
-        )
         self.key_limits_path = os.path.join(
             os.path.expanduser("~"),
             "_".join(("weir", self.zone, CACHE_LIMIT_FILE_NAME)),
@@ -347,7 +780,35 @@ class PolicyGenerator:
         self.logger.info(
             f"Initialized per-key limits (Only non-DEFAULT keys are listed): {self.key_limits}"
         )
+        self.should_reload_limits = False
         self.redis_keys_batch = self.config["redis_keys_batch"]
+
+        # QoS redis server
+        redis_configs = self.config["redis_server"].split(":")
+        self.redis_server = redis.Redis(
+            host=redis_configs[0],
+            port=int(redis_configs[1]),
+            db=0,
+            decode_responses=True,
+            # We hold onto our connections for as long as we run, so have the OS check they're still alive
+            # rather than only finding out that one has gone away when the next check loop tries to use it
+            socket_keepalive=True,
+            socket_keepalive_options={
+                socket.TCP_KEEPIDLE: 30,
+                socket.TCP_KEEPINTVL: 10,
+                socket.TCP_KEEPCNT: 3,
+            },
+        )
+        self.logger.info(f"Connecting to redisServer {self.config['redis_server']}")
+
+        if checks_violations:
+            self._init_violation_checks(worker_messages)
+
+        self.logger.info("PolicyGenerator initilization completed")
+
+    def _init_violation_checks(
+        self, worker_messages: multiprocessing.queues.Queue[WorkerMessage] | None
+    ) -> None:
         self.polygen_lua_path = self.config["polygen_lua_path"]
 
         self.reqs_unblock_backoff_time_ms: int = self.config.get(
@@ -361,15 +822,17 @@ class PolicyGenerator:
             DEFAULT_AREQ_LIMIT_IF_QOS_IS_NOT_CONFIGURED,
         )
 
-        # QoS redis server
-        redis_configs = self.config["redis_server"].split(":")
-        self.redis_server = redis.Redis(
-            host=redis_configs[0],
-            port=int(redis_configs[1]),
-            db=0,
-            decode_responses=True,
-        )
-        self.logger.info(f"Connecting to redisServer {self.config['redis_server']}")
+        self.haproxies_map: PolicyQueueMap
+        if worker_messages is not None:
+            # The main process sends our policies on to the haproxies for us
+            self.haproxies_map = {
+                endpoint: [PolicyRelay(endpoint, worker_messages)]
+                for endpoint in self.config["haproxy_servers"]
+            }
+        else:
+            # Otherwise we're on our own, so send them to the haproxies ourselves
+            self.policy_sender = PolicySender(self.logger, self.config)
+            self.haproxies_map = self.policy_sender.haproxies_map
 
         # thread pool for checking policy violations
         self.avgChkVioRunTimeList: list[float] = []
@@ -379,151 +842,117 @@ class PolicyGenerator:
         self.vio_chk_executor = futures.ThreadPoolExecutor(self.vio_chk_thread_num)
         self.logger.info("Check_violation threadpool created.")
 
-        # thread pool for sending policies
-        self.send_policies_executor = futures.ThreadPoolExecutor(
-            thread_name_prefix="send_policy", max_workers=len(self.haproxies)
-        )
-        self.send_policies_executor.map(self._send_policies, self.haproxies)
-        self.logger.info(
-            f"Send_policy threadpool created for {len(self.haproxies)} haproxies."
-        )
-
-        # fifo file for reloading limits
-        self.reload_fifo_path = os.path.join(
-            "/tmp", "_".join(("weir", self.config["zone"], RELOAD_FIFO_NAME))
-        )
-        self.make_fifo(self.reload_fifo_path)
-        self.should_reload_limits = False
-
-        self.logger.info("Creating thread to monitor reload_fifo...")
-        self.x = threading.Thread(target=self._monitor_reload_fifo)
-        self.x.start()
-
-        self.logger.info("PolicyGenerator initilization completed")
-
-    def _load_config(self, config_file: str) -> dict[str, Any]:
-        try:
-            with open(config_file) as f:
-                config = yaml.safe_load(f)
-        except yaml.YAMLError as e:
-            # We need the config to setup the logger, so we have to rely on `print` instead here
-            print(f"YAML error: {e}")
-            raise
-        except OSError:
-            print(f"Could not open/load config file {config_file}")
-            raise
-        return config
-
     def _load_limits_from_file(self, file_path: str) -> LimitConfig:
         self.logger.info(f"Loading limits from file {file_path}")
         if not os.path.isfile(file_path):
             self.logger.error(f"no {file_path} existed, nothing was cached")
             return LimitConfig({}, {})
         try:
-            with open(file_path, "r") as targeted_file:
-                config_dict = json.load(targeted_file)
+            with open(file_path, "rb") as targeted_file:
+                config_dict = json_loads(targeted_file.read())
                 return LimitConfig(**config_dict)
         except Exception as e:
             self.logger.exception(f"Failed to load json from {file_path} {e}")
             return LimitConfig({}, {})
 
-    def _get_haproxies_from_config(
-        self, config: dict[str, Any]
-    ) -> tuple[list[HaproxyServer], HaproxyServerMap]:
-        self.policy_msg_queue_size = config["policy_msg_queue_size"]
-
-        haproxies: list[HaproxyServer] = []
-        haproxies_map: HaproxyServerMap = {}
-        for endpoint in config["haproxy_servers"]:
-            for k in config["haproxy_servers"][endpoint]:
-                items = k.strip().split(":")
-                if len(items) == 2:
-                    haproxy_server = HaproxyServer(
-                        self.logger,
-                        self.zone,
-                        endpoint,
-                        items[0],
-                        int(items[1]),
-                        config["sleep_time"],
-                        self.policy_msg_queue_size,
-                    )
-                    haproxies.append(haproxy_server)
+    def check_reload_requested(self) -> None:
+        # The main process bumps limits_generation whenever it reads a reload request from the FIFO
+        if (
+            self.limits_generation is not None
+            and self.limits_generation.value != self.loaded_limits_generation
+        ):
+            self.should_reload_limits = True
 
-                    if endpoint not in haproxies_map:
-                        haproxies_map[endpoint] = []
-                    haproxies_map[endpoint].append(haproxy_server)
-
-                    self.logger.info(
-                        f"Haproxy machine for endpoint {endpoint} - {items[0]}:{items[1]}"
-                    )
-        return haproxies, haproxies_map
-
-    def _send_policies(self, haproxy_server: HaproxyServer) -> None:
-        haproxy_server.run()
+    def _load_redis_get_fields_lua(self) -> None:
+        if self.polygen_lua_path not in _LUA_SCRIPT_CACHE:
+            with open(self.polygen_lua_path) as f:
+                script = f.read()
+            # The hash is only used by redis to identify the script, not for anything security-related
+            script_sha1 = sha1(
+                script.encode("utf-8"), usedforsecurity=False
+            ).hexdigest()
+            _LUA_SCRIPT_CACHE[self.polygen_lua_path] = (script, script_sha1)
+        self.redis_get_lua, self.redis_get_sha1 = _LUA_SCRIPT_CACHE[
+            self.polygen_lua_path
+        ]
+
+    @property
+    def key_limits(self) -> LimitConfig:
+        return self._key_limits
+
+    @key_limits.setter
+    def key_limits(self, key_limits: LimitConfig) -> None:
+        self._key_limits = key_limits
+        # Any limits we looked up from the previous config may no longer be valid, so start a fresh cache
+        self._cached_limit_lookup = functools.lru_cache(maxsize=LIMIT_CACHE_SIZE)(
+            self._lookup_limit
+        )
+        # Maps a (scope prefix, user key) to that user's limit for each verb usage field
+        self._verb_limit_tables: dict[
+            tuple[str, str], dict[str, tuple[float, bool]]
+        ] = {}
+        self.min_verb_limits = self._min_verb_limits(key_limits)
 
     @staticmethod
-    def make_fifo(fifo_path: str) -> None:
-        try:
-            os.mkfifo(fifo_path)
-            os.chmod(fifo_path, 0o666)
-        except OSError as e:
-            os.chmod(fifo_path, 0o666)
-            if e.errno != errno.EEXIST:
-                raise
-
-    def _monitor_reload_fifo(self) -> None:
-        # users write "reload_limits" to the zone FIFO file to trigger the limits reload for this specific zone
-        # example command:
-        # echo "reload_limits" > /tmp/weir_dev_polygen_reload.fifo
-        while True:
-            with open(self.reload_fifo_path) as fifo:
-                self.logger.info("Reload FIFO opened")
-                while True:
-                    data = fifo.read()
-                    if len(data) == 0:
-                        self.logger.info("Writer closed the FIFO")
-                        break
-                    request = data.strip()
-                    if request == RELOAD_LIMITS_REQ:
-                        self.logger.info("Receive FIFO reload_limits request.")
-                        self.should_reload_limits = True
-
-    def _load_redis_get_fields_lua(self) -> None:
-        with open(self.polygen_lua_path) as f:
-            self.redis_get_lua = f.read()
-        self.redis_get_sha1 = sha1(self.redis_get_lua.encode("utf-8")).hexdigest()
+    def _min_verb_limits(key_limits: LimitConfig) -> tuple[float, float]:
+        """
+        Returns lower bounds on every user-level request-rate limit and bandwidth limit (in bytes)
+        that _check_violation_per_key_verb could apply. Usage below these can't be a violation,
+        so we pass them to the redis script to avoid it sending such usage back to us at all.
+        """
+        min_rate_limit: float = DEFAULT_VERB_RATE_LIMIT_IF_QOS_IS_NOT_CONFIGURED
+        min_bnd_limit: float = DEFAULT_VERB_BDW_LIMIT_IF_QOS_IS_NOT_CONFIGURED
+        # Like LimitConfig, skip any malformed QoS entries rather than failing every check
+        well_formed_qos = (q for q in key_limits.qos.values() if isinstance(q, dict))
+        for qos_limits in well_formed_qos:
+            for cat, limit in qos_limits.items():
+                if limit == QOS_VERB_LIMIT_NOT_CONFIGURED:
+                    continue
+                if cat == "user_bnd_up" or cat == "user_bnd_dwn":
+                    min_bnd_limit = min(min_bnd_limit, limit)
+                elif (
+                    cat.startswith("user_")
+                    and AREQ_LIMITING_CATEGORY_PATTERN not in cat
+                ):
+                    min_rate_limit = min(min_rate_limit, limit)
+        return (min_rate_limit, min_bnd_limit * MB)
 
     def _get_limit(self, cat: str, key: str) -> float:
-        # Try to get the configured QoS ID for the user
-        qos_id = self.key_limits.user_to_qos_id.get(key)
-        if qos_id and isinstance(qos_id, str):
-            qos_id_limits = self.key_limits.qos.get(qos_id, {})
-            if isinstance(qos_id_limits, dict):
-                limit = qos_id_limits.get(cat, QOS_VERB_LIMIT_NOT_CONFIGURED)
-                if limit != QOS_VERB_LIMIT_NOT_CONFIGURED:
-                    self.logger.debug(
-                        f"For {key} {cat}, {limit} is found in the configuration"
-                    )
-                    return limit
+        limit, is_configured = self._cached_limit_lookup(cat, key)
+        if not is_configured:
+            self.unknown_users.add(key)
+        return limit
+
+    def _lookup_limit(self, cat: str, key: str) -> tuple[float, bool]:
+        """
+        Returns the limit for the given cat(egory) and user key, along with whether
+        that limit was configured specifically for the user (as opposed to being a fallback).
+        The result depends only on the current key_limits so it is cached by _get_limit.
+        """
+        # Try to get the limit configured for the user's QoS ID
+        limit = self.key_limits.configured_limits.get((key, cat))
+        if limit is not None:
+            self.logger.debug(
+                "For %s %s, %s is found in the configuration", key, cat, limit
+            )
+            return (limit, True)
 
         # Fallback to DEFAULT limits if not found
-        self.unknown_users.add(key)
-        default_policy_name = self.key_limits.user_to_qos_id.get(
-            DEFAULT_QOS_ID, "DEFAULT"
-        )
-        qos_id_limits = self.key_limits.qos.get(default_policy_name, {})
-        if isinstance(qos_id_limits, dict):
-            limit = qos_id_limits.get(cat, QOS_VERB_LIMIT_NOT_CONFIGURED)
-            if limit != QOS_VERB_LIMIT_NOT_CONFIGURED:
-                self.logger.debug(
-                    f"For {key} {cat}, {limit} is using {DEFAULT_QOS_ID} configured limit"
-                )
-                return limit
+        limit = self.key_limits.default_limits.get(cat)
+        if limit is not None:
+            self.logger.debug(
+                "For %s %s, %s is using %s configured limit",
+                key,
+                cat,
+                limit,
+                DEFAULT_QOS_ID,
+            )
+            return (limit, False)
 
         # Fallback to hard-coded value if DEFAULT limits are not defined
         limit = self._use_hard_coded_limit(cat)
         self.logger.warning(f"For {key} {cat}, {limit} is using hard-coded limit")
-        return limit
+        return (limit, False)
 
     def _use_hard_coded_limit(self, cat: str) -> float:
         """
@@ -548,19 +977,47 @@ class PolicyGenerator:
         else:
             return DEFAULT_VERB_RATE_LIMIT_IF_QOS_IS_NOT_CONFIGURED
 
+    def _get_verb_limit_table(
+        self, cat_prefix: str, key: str
+    ) -> dict[str, tuple[float, bool]]:
+        """
+        Returns the table of the given user's limits in the given scope, keyed by verb usage field.
+        _check_violation_per_key_verb fills it in from _get_verb_limit as it sees each field, so after
+        the first epoch checking a user's usage takes a single dict lookup per field.
+        """
+        table_key = (cat_prefix, key)
+        verb_limits = self._verb_limit_tables.get(table_key)
+        if verb_limits is None:
+            # Like the limit lookup cache, don't let unknown keys grow this without bound
+            if len(self._verb_limit_tables) >= LIMIT_CACHE_SIZE:
+                self._verb_limit_tables.clear()
+            verb_limits = {}
+            self._verb_limit_tables[table_key] = verb_limits
+        return verb_limits
+
+    def _get_verb_limit(self, cat: str, key: str) -> tuple[float, bool]:
+        limit, is_configured = self._cached_limit_lookup(cat, key)
+        # Bandwidth limits are configured in MB but measured in bytes
+        if cat == "user_bnd_up" or cat == "user_bnd_dwn":
+            limit *= MB
+        return (limit, is_configured)
+
     def _is_limit_reached_verb_type(
         self, cat: str, key: str, val: float
     ) -> tuple[bool, float]:
-        limit = float(self._get_limit(cat, key))
-        self.logger.debug(f"Limit is {limit} for {cat} {key} current val is {val}")
+        limit, is_configured = self._get_verb_limit(cat, key)
+        if not is_configured:
+            self.unknown_users.add(key)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                "Limit is %s for %s %s current val is %s", limit, cat, key, val
+            )
 
         # e.g., val=100 & limit=50, violation is larger than the limit by a factor of 2
-        factor_mapping = {"user_bnd_up": MB, "user_bnd_dwn": MB}
-        if val < limit * factor_mapping.get(cat, 1):
+        if val < limit:
             return (False, 0.0)
         else:
-            difference_ratio = float(val) / (limit * factor_mapping.get(cat, 1))
-            return (True, float("{:.1f}".format(difference_ratio)))
+            return (True, round(val / limit, 1))
 
     def _check_violation_per_key_verb(
         self, key: str, redis_scan_result: list[str], epoch_time: float
@@ -577,30 +1034,54 @@ class PolicyGenerator:
             self.logger.warning(f"Could not parse key {key} due to {ex}")
             return
 
-        self.logger.debug(f"{epoch_time} {metric}")
-        for i in range(0, len(redis_scan_result), 2):
-            val = float(redis_scan_result[i + 1])
-            limit_reached, diff_ratio = self._is_limit_reached_verb_type(
-                "_".join((metric.scope.value, redis_scan_result[i])),
-                metric.access_key,
-                val,
-            )
-            if limit_reached:
+        # We won't look up this user's limits if none of their usage is high enough to be a violation,
+        # but we still want to know about them if they don't have any limits configured
+        if metric.access_key not in self.key_limits.user_to_qos_id:
+            self.unknown_users.add(metric.access_key)
+
+        # Checked once up front, rather than formatting debug messages for every field only to drop them
+        debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        if debug_enabled:
+            self.logger.debug("%s %s", epoch_time, metric)
+        # The result is a flat list of alternating field names and values, so pair them back up
+        fields_and_values = iter(redis_scan_result)
+        cat_prefix = metric.scope.value + "_"
+        verb_limits = self._get_verb_limit_table(cat_prefix, metric.access_key)
+        for field, raw_val in zip(fields_and_values, fields_and_values):
+            val = float(raw_val)
+            limit_and_is_configured = verb_limits.get(field)
+            if limit_and_is_configured is None:
+                limit_and_is_configured = self._get_verb_limit(
+                    cat_prefix + field, metric.access_key
+                )
+                verb_limits[field] = limit_and_is_configured
+            limit, is_configured = limit_and_is_configured
+            if not is_configured:
+                self.unknown_users.add(metric.access_key)
+
+            # e.g., val=100 & limit=50, violation is larger than the limit by a factor of 2
+            if val >= limit:
                 self.policies.add_violation(
                     epoch_time,
                     metric,
-                    UsageValue.from_string(redis_scan_result[i]),
-                    diff_ratio,
+                    UsageValue.from_string(field),
+                    round(val / limit, 1),
                 )
-            else:
+            elif debug_enabled:
                 self.logger.debug(
-                    f"No violation found for {metric.access_key} {metric.scope} {val}"
+                    "No violation found for %s %s %s",
+                    metric.access_key,
+                    metric.scope,
+                    val,
                 )
 
     def _is_limit_reached_conn(self, key: str, val: int) -> tuple[bool, float]:
         cat = "user_conns"
         conn_limit = int(self._get_limit(cat, key))
-        self.logger.debug(f"Limit is {conn_limit} for {cat} {key} current val is {val}")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                "Limit is %s for %s %s current val is %s", conn_limit, cat, key, val
+            )
 
         ratio: float = val / conn_limit
         return (ratio >= 1, ratio)
@@ -609,30 +1090,32 @@ class PolicyGenerator:
         self, keys: list[str], conn_counts: list[str], epoch_time: float
     ) -> None:
         assert len(keys) == len(conn_counts)
+        epoch_sec = int(epoch_time)
         unmerged_metrics: list[UserLevelActiveRequestsUsage] = []
-        for string_index, raw_metric_string in enumerate(keys):
+        for raw_metric_string, conn_count in zip(keys, conn_counts):
             metric = MetricService.create_user_level_metric(
-                raw_metric_string, int(epoch_time)
+                raw_metric_string, epoch_sec
             )
             assert isinstance(metric, UserLevelActiveRequestsUsage)
-            metric.data = int(conn_counts[string_index])
+            metric.data = int(conn_count)
             unmerged_metrics.append(metric)
         metrics = MetricService.merge_metrics_by_key(unmerged_metrics)
 
+        debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        violations: list[tuple[UserLevelUsage, UsageValue, float]] = []
         for metric in metrics:
             limit_reached, diff_ratio = self._is_limit_reached_conn(
                 metric.access_key, metric.data
             )
-            is_blocked = metric.access_key in self.blocked_users
-            ready_for_heartbeat = not is_blocked or (
-                (
-                    self.blocked_users[metric.access_key]
-                    + (self.reqs_unblock_backoff_time_ms / MSECS_IN_SEC)
-                )
+            blocked_at = self.blocked_users.get(metric.access_key)
+            is_blocked = blocked_at is not None
+            ready_for_heartbeat = blocked_at is None or (
+                (blocked_at + (self.reqs_unblock_backoff_time_ms / MSECS_IN_SEC))
                 < epoch_time
             )
 
-            self.logger.debug(f"{epoch_time} {metric}")
+            if debug_enabled:
+                self.logger.debug("%s %s", epoch_time, metric)
             if (
                 (  # You're not blocked but you should be
                     limit_reached and not is_blocked
@@ -647,29 +1130,42 @@ class PolicyGenerator:
                     and (diff_ratio > self.reqs_unblock_ratio)
                 )
             ):
-                self.policies.add_violation(
-                    epoch_time, metric, UsageValue.REQUESTS_BLOCK
-                )
+                violations.append((metric, _REQUESTS_BLOCK, 1.0))
                 self.blocked_users[metric.access_key] = epoch_time
 
             elif is_blocked and (diff_ratio <= self.reqs_unblock_ratio):
                 # You are blocked but you shouldn't be
-                self.policies.add_violation(
-                    epoch_time, metric, UsageValue.REQUESTS_UNBLOCK
-                )
+                violations.append((metric, _REQUESTS_UNBLOCK, 1.0))
                 del self.blocked_users[metric.access_key]
 
+        if violations:
+            self.policies.add_violations(epoch_time, violations)
+
     def _check_violation(
         self, keys: list[str], redis_key_type: str, epoch_time: float
     ) -> None:
-        self.logger.debug(f"_check_violation for {len(keys)} keys")
+        self.logger.debug("_check_violation for %s keys", len(keys))
 
         @avg_time(self.avgChkVioRunTimeList, 5000, self.zone, self.logger, len(keys))
         def check_violation_key(keys: list[str], redis_key_type: str) -> None:
-            redis_scan_result = self.call_redis_eval(
-                self.redis_get_lua, self.redis_get_sha1, keys
+            # Keep each script call to a bounded number of keys so that we don't block redis for too long,
+            # but send all of them in one go so that we only pay for a single round-trip
+            key_batches = [
+                list(batch) for batch in itertools.batched(keys, self.redis_keys_batch)
+            ]
+            # For verb keys, let the script drop any usage that's too low to be violating a limit
+            script_args = (
+                self.min_verb_limits if redis_key_type == REDIS_KEY_TYPE_VERB else ()
             )
-            self.logger.debug(f"redis result: {redis_scan_result}")
+            redis_scan_result = [
+                result
+                for batch_result in self.call_redis_eval(
+                    self.redis_get_lua, self.redis_get_sha1, key_batches, script_args
+                )
+                for result in batch_result
+            ]
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("redis result: %s", redis_scan_result)
 
             if redis_key_type == REDIS_KEY_TYPE_CONN:
                 self._check_all_conn_key_violations(keys, redis_scan_result, epoch_time)
@@ -686,15 +1182,32 @@ class PolicyGenerator:
 
         self.policies.prepare_message(self.haproxies_map, epoch_time)
 
-    def call_redis_eval(self, script: str, script_sha1: str, keys: list[str]) -> Any:
+    def call_redis_eval(
+        self,
+        script: str,
+        script_sha1: str,
+        key_batches: list[list[str]],
+        args: Iterable[float] = (),
+    ) -> list[Any]:
+        def execute_pipeline(use_sha1: bool) -> list[Any]:
+            pipe = self.redis_server.pipeline(transaction=False)
+            for keys in key_batches:
+                if use_sha1:
+                    pipe.evalsha(script_sha1, len(keys), *keys, *args)
+                else:
+                    pipe.eval(script, len(keys), *keys, *args)
+            return pipe.execute()
+
         try:
-            return self.redis_server.evalsha(script_sha1, len(keys), *keys)
+            return execute_pipeline(use_sha1=True)
         except redis.exceptions.NoScriptError:
-            return self.redis_server.eval(script, len(keys), *keys)
+            return execute_pipeline(use_sha1=False)
 
     def reload_limits(self) -> None:
         self.logger.info(f"Reloading limits from config file {self.key_limits_path}")
         self.should_reload_limits = False
+        if self.limits_generation is not None:
+            self.loaded_limits_generation = self.limits_generation.value
         self.key_limits = self._load_limits_from_file(self.key_limits_path)
         self.logger.info(
             f"Current per-key limits (Only non-DEFAULT keys are listed): {self.key_limits} "
@@ -713,30 +1226,19 @@ class PolicyGenerator:
         Takes in the aggregated demand map and outputs the limit shares to send to all haproxy instances.
         The resulting DemandMap has one entry for each user/direction/instance triplet.
         """
-        keys_to_send = set([DemandKey(k.user_key, k.direction) for k in demand.keys()])
-
         result: DemandMap = {}
-        for key in keys_to_send:
-            all_instances = set([])
-            current_total_user_demand = 0
-            for instance_id, instance_demand in demand.get(key, {}).items():
-                current_total_user_demand += instance_demand
-                all_instances.add(instance_id)
-            if current_total_user_demand == 0:
+        for key, instance_demands in demand.items():
+            total_user_demand = sum(instance_demands.values())
+            if total_user_demand == 0:
                 continue
 
-            user_limit = {
-                Direction.Up: self._get_limit("user_bnd_up", key.user_key) * MB,
-                Direction.Down: self._get_limit("user_bnd_dwn", key.user_key) * MB,
+            # Each instance gets the same share of the user's limit as its share of the user's total demand
+            cat = _BANDWIDTH_LIMIT_CATEGORIES[key.direction]
+            user_limit = self._get_limit(cat, key.user_key) * MB
+            result[key] = {
+                instance_id: int(user_limit * (instance_demand / total_user_demand))
+                for instance_id, instance_demand in instance_demands.items()
             }
-
-            result[key] = {}
-            for instance_id in all_instances:
-                instance_current_demand = demand.get(key, {}).get(instance_id, 0)
-                share = instance_current_demand / current_total_user_demand
-
-                limit = int(user_limit[key.direction] * share)
-                result[key][instance_id] = limit
         return result
 
 
@@ -754,8 +1256,12 @@ def check_loop(
         1,
     )
     def check_loop_epoch() -> None:
-        epoch_time = time.time()
-        epoch_sec = int(epoch_time)
+        # We work in integer nanoseconds, so that checking whether we've moved onto the next second
+        # is a single comparison rather than needing to convert the time to whole seconds each time
+        start_ns = time.time_ns()
+        epoch_sec = start_ns // NSECS_IN_SEC
+        next_epoch_start_ns = (epoch_sec + 1) * NSECS_IN_SEC
+        now_ns = start_ns
         cursor = 0
         if redis_key_type == REDIS_KEY_TYPE_VERB:
             scan_pattern = f"verb_{epoch_sec}_*"
@@ -785,10 +1291,11 @@ def check_loop(
                 # have been messed up here.
                 break
 
-            epoch_time = time.time()
-            if int(epoch_time) != epoch_sec:
+            now_ns = time.time_ns()
+            if now_ns >= next_epoch_start_ns:
                 policy_generator.logger.debug(
-                    f"Redis scan started at {epoch_time} spilled over the next second"
+                    "Redis scan started at %s spilled over the next second",
+                    start_ns / NSECS_IN_SEC,
                 )
                 return
 
@@ -798,11 +1305,12 @@ def check_loop(
                 break
         if len(all_keys_to_check) > 0:
             policy_generator.submit_violation_check(
-                list(all_keys_to_check), redis_key_type, epoch_time
+                list(all_keys_to_check), redis_key_type, now_ns / NSECS_IN_SEC
             )
 
     while True:
         # check reload_limits
+        policy_generator.check_reload_requested()
         if policy_generator.should_reload_limits:
             policy_generator.reload_limits()
         policy_generator.unknown_users.report()
@@ -831,20 +1339,21 @@ def demand_check_loop(
             if conn_count is None:
                 continue
 
-            key_components = conn_key.split("_")
-            if len(key_components) < 6:
+            key_match = _CONN_V2_KEY_RE.fullmatch(conn_key)
+            if key_match is None:
                 policy_generator.logger.warning(f"Invalid connection key {conn_key}")
-                return
-            direction_str, instance_id, user_endpoint = key_components[3:]
-            user_key = user_endpoint.split("$")[0]
+                continue
+            direction_str, instance_id, user_key = key_match.groups()
 
-            direction = Direction.from_str(direction_str)
-            key = DemandKey(user_key, direction)
-            if key not in demand:
-                demand[key] = {}
-            if instance_id not in demand[key]:
-                demand[key][instance_id] = 0
-            demand[key][instance_id] += int(conn_count)
+            direction = _DIRECTIONS_BY_STR.get(direction_str)
+            if direction is None:
+                policy_generator.logger.warning(
+                    f"Invalid connection direction in key {conn_key}"
+                )
+                continue
+            instance_demand = demand.setdefault(DemandKey(user_key, direction), {})
+            current_count = instance_demand.get(instance_id, 0)
+            instance_demand[instance_id] = current_count + int(conn_count)
 
     @avg_time(
         avg_pol_gen_loop_run_time_list,
@@ -854,55 +1363,88 @@ def demand_check_loop(
         1,
     )
     def limit_share_check_loop(haproxies: list[HaproxyServer]) -> None:
+        demand: DemandMap = {}
         try:
-            # SCAN is permitted to return duplicates. So we need to filter those out and just keep
-            # a list of unique keys, otherwise we can double-count some entries
-            conn_keys = list(
-                set(
-                    policy_generator.redis_server.scan_iter(
-                        match="conn_v2_*", count=policy_generator.redis_keys_batch
-                    )
+            # Rather than collecting every key before fetching all of their counts at once, we fetch the counts
+            # for each batch of keys as SCAN returns them, so that neither we nor redis have to hold onto them all.
+            # Each batch's MGET goes in the same pipeline as the SCAN for the next batch, to save a round-trip.
+            redis_server = policy_generator.redis_server
+            seen_conn_keys: set[str] = set()
+            conn_keys: list[str] = []
+            cursor = 0
+            while True:
+                pipe = redis_server.pipeline(transaction=False)
+                pipe.scan(
+                    cursor, match="conn_v2_*", count=policy_generator.redis_keys_batch
                 )
-            )
-            conn_counts = policy_generator.redis_server.mget(conn_keys)
-            assert isinstance(conn_counts, list)
+                if len(conn_keys) > 0:
+                    pipe.mget(conn_keys)
+                replies = pipe.execute()
+                cursor, key_batch = replies[0]
+                if len(conn_keys) > 0:
+                    aggregate_demand_from_conn_v2(demand, zip(conn_keys, replies[1]))
+
+                # SCAN is permitted to return duplicates. So we need to filter those out and just keep
+                # the unique keys, otherwise we can double-count some entries
+                conn_keys = []
+                for conn_key in key_batch:
+                    if conn_key not in seen_conn_keys:
+                        seen_conn_keys.add(conn_key)
+                        conn_keys.append(conn_key)
+                if cursor == 0:
+                    break
+
+            if len(conn_keys) > 0:
+                conn_counts = redis_server.mget(conn_keys)
+                assert isinstance(conn_counts, list)
+                aggregate_demand_from_conn_v2(demand, zip(conn_keys, conn_counts))
         except Exception as e:
             policy_generator.logger.warning(
                 "Failed to collect demand info from redis", exc_info=e
             )
             return
 
-        demand: DemandMap = {}
-        aggregate_demand_from_conn_v2(demand, zip(conn_keys, conn_counts))
-
         epoch_ms = int(time.time() * 1000)
         limit_share = policy_generator.compute_bandwidth_limit_share(demand)
-        limit_share_msgs = []
-        for key in limit_share:
-            user_share = []
-            for instance_id in limit_share[key]:
-                demand_val = limit_share[key][instance_id]
-                if demand_val > 0:
-                    dir_str = str(key.direction)
-                    user_share.append(f"{instance_id}_{dir_str}_{demand_val}")
-            limit_share_msgs.append(f"{epoch_ms},{key.user_key},{','.join(user_share)}")
-
-        if len(limit_share_msgs) > 0:
-            limit_share_str = "\n".join(
-                ("limit_share", *limit_share_msgs, "end_limit_share\n")
-            )
+
+        if len(limit_share) > 0:
+            # Write each user's line straight into the one buffer, rather than building up a list of
+            # lines (each built from its own list of shares) only to join them all together at the end
+            buf = io.StringIO()
+            buf.write("limit_share\n")
+            for key, instance_shares in limit_share.items():
+                dir_str = str(key.direction)
+                buf.write(f"{epoch_ms},{key.user_key},")
+                buf.write(
+                    ",".join(
+                        f"{instance_id}_{dir_str}_{share}"
+                        for instance_id, share in instance_shares.items()
+                        if share > 0
+                    )
+                )
+                buf.write("\n")
+            buf.write("end_limit_share\n")
+            limit_share_str = buf.getvalue()
             policy_generator.logger.debug(
-                f"Sending limit-share message to all HAProxies: {limit_share_str}\n"
-                + f"Limit-share computed from demand: {str(demand)}"
+                "Sending limit-share message to all HAProxies: %s\n"
+                "Limit-share computed from demand: %s",
+                limit_share_str,
+                demand,
             )
-            try:
-                for server in haproxies:
-                    server._send_policies(limit_share_str)
-            except Exception as e:
-                policy_generator.logger.warning(
-                    "Failed to send limit-share info to haproxy ", exc_info=e
-                )
-                return
+            limit_share_bytes = limit_share_str.encode()
+
+            def send_limit_share(server: HaproxyServer) -> None:
+                try:
+                    server._send_policies(limit_share_bytes)
+                except Exception as e:
+                    policy_generator.logger.warning(
+                        "Failed to send limit-share info to haproxy ", exc_info=e
+                    )
+
+            # Send to every haproxy at once, so that a slow one doesn't hold up the rest
+            # (and the next round) behind it. Each server keeps its own connection between rounds.
+            for _ in limit_share_executor.map(send_limit_share, haproxies):
+                pass
 
     # We shouldn't need to send limit-share info anywhere near as often as we send violations
     # because that info translates to a limit that can be applied for a while, rather
@@ -910,8 +1452,19 @@ def demand_check_loop(
     # We pick a fairly arbitrary multiplier to apply to the usually-configured
     # sleep time as a starting point.
     demand_sleep_multiplier = 100
-    haproxies, _ = policy_generator._get_haproxies_from_config(policy_generator.config)
+    # Unlike violations, limit shares are sent synchronously and with their own framing,
+    # so we keep our own connections to the haproxies for them rather than going via the main process
+    haproxies, _ = get_haproxies_from_config(
+        policy_generator.logger, policy_generator.config
+    )
+    limit_share_executor = futures.ThreadPoolExecutor(
+        max(1, len(haproxies)), thread_name_prefix="send_limit_share"
+    )
     while True:
+        policy_generator.check_reload_requested()
+        if policy_generator.should_reload_limits:
+            policy_generator.reload_limits()
+        policy_generator.unknown_users.report()
         limit_share_check_loop(haproxies)
         time.sleep(demand_sleep_multiplier * sleep_time_milliseconds * 0.001)
 
@@ -922,11 +1475,21 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
-if __name__ == "__main__":
-    args = parse_args()
-    config_file = args.config_file
+def run_worker(
+    config_file: str,
+    worker: str,
+    limits_generation: multiprocessing.sharedctypes.Synchronized[int],
+    worker_messages: multiprocessing.queues.Queue[WorkerMessage],
+    log_queue: multiprocessing.queues.Queue[logging.LogRecord],
+) -> None:
     try:
-        policy_generator = PolicyGenerator(config_file)
+        policy_generator = PolicyGenerator(
+            config_file,
+            limits_generation,
+            worker_messages,
+            log_queue,
+            checks_violations=worker != WORKER_DEMAND,
+        )
     except Exception as e:
         # When something happened during starting up, this program will raise Exception
         # But there might be some other threads started when initializing policy generator
@@ -934,35 +1497,121 @@ if __name__ == "__main__":
         logging.exception(f"Policy Generator initialization failed: {e}")
         raise
 
-    verb_thread = threading.Thread(
-        target=check_loop,
-        args=(
-            policy_generator,
-            REDIS_KEY_TYPE_VERB,
-            policy_generator.sleep_time_milliseconds,
-        ),
+    if worker == WORKER_DEMAND:
+        demand_check_loop(policy_generator, policy_generator.sleep_time_milliseconds)
+    else:
+        check_loop(policy_generator, worker, policy_generator.sleep_time_milliseconds)
+
+
+def relay_worker_messages(
+    workers: Sequence[multiprocessing.process.BaseProcess],
+    worker_messages: multiprocessing.queues.Queue[WorkerMessage],
+    policy_sender: PolicySender,
+    unknown_users: UnknownUsers,
+    reload_fifo: ReloadFifo,
+    limits_generation: multiprocessing.sharedctypes.Synchronized[int],
+    sleep_time_milliseconds: int,
+) -> None:
+    """
+    Passes the policies and unknown users that the workers send us on to be sent and reported,
+    and any reload requests from the FIFO on to the workers, until any of the workers stops.
+    """
+
+    def handle(worker_message: WorkerMessage) -> None:
+        if isinstance(worker_message, PolicyMessage):
+            policy_sender.add_message(*worker_message)
+        else:
+            unknown_users.update(worker_message.users)
+
+    while all(worker_process.is_alive() for worker_process in workers):
+        try:
+            worker_message = worker_messages.get(
+                timeout=sleep_time_milliseconds * 0.001
+            )
+        except queue.Empty:
+            pass
+        else:
+            handle(worker_message)
+
+        if reload_fifo.check():
+            with limits_generation.get_lock():
+                limits_generation.value += 1
+        unknown_users.report()
+
+    # Don't drop whatever a worker sent us just before it stopped
+    while True:
+        try:
+            worker_message = worker_messages.get_nowait()
+        except queue.Empty:
+            break
+        handle(worker_message)
+
+
+def main(config_file: str) -> int:
+    config = load_config(config_file)
+    logger = init_logger(
+        "policy_generator", 10, config.get("log_file_name", None), config["log_level"]
+    )
+
+    # Each loop spends much of its time parsing keys and checking them in Python, so we run each in
+    # its own process with its own PolicyGenerator, rather than have them all contend for the one GIL.
+    # The workers pass their policies to us to send, so that only we connect to the haproxies to send them,
+    # and their log records to us to write out, so that only we ever write to (and rotate) the log file.
+    limits_generation: multiprocessing.sharedctypes.Synchronized[int] = (
+        multiprocessing.Value("L", 0)
     )
-    verb_thread.start()
-
-    conn_thread = threading.Thread(
-        target=check_loop,
-        args=(
-            policy_generator,
-            REDIS_KEY_TYPE_CONN,
-            policy_generator.sleep_time_milliseconds,
-        ),
+    worker_messages: multiprocessing.queues.Queue[WorkerMessage] = (
+        multiprocessing.Queue()
     )
-    conn_thread.start()
-
-    demand_thread = threading.Thread(
-        target=demand_check_loop,
-        args=(
-            policy_generator,
-            policy_generator.sleep_time_milliseconds,
-        ),
+    log_queue: multiprocessing.queues.Queue[logging.LogRecord] = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(config_file, worker, limits_generation, worker_messages, log_queue),
+            name=f"{worker}_check",
+        )
+        for worker in (REDIS_KEY_TYPE_VERB, REDIS_KEY_TYPE_CONN, WORKER_DEMAND)
+    ]
+    # Start the workers before we start any threads of our own, so that they aren't forked part way through anything
+    for worker_process in workers:
+        worker_process.start()
+    log_listener = logging.handlers.QueueListener(
+        log_queue, *logging.getLogger().handlers, respect_handler_level=True
     )
-    demand_thread.start()
+    log_listener.start()
 
-    demand_thread.join()
-    verb_thread.join()
-    conn_thread.join()
+    # Make sure the workers don't outlive us when we're asked to stop, by having SIGTERM interrupt us like Ctrl-C does
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        policy_sender = PolicySender(logger, config)
+        unknown_users = UnknownUsers(
+            config.get("unknown_users_report_time_seconds", 60), logger
+        )
+        # We're the only ones to read the FIFO, and pass any reload requests on to all of the workers
+        reload_fifo = ReloadFifo(logger, reload_fifo_path(config["zone"]))
+
+        # If any of the workers stops then stop the rest too, so that we exit and can be restarted as a whole
+        relay_worker_messages(
+            workers,
+            worker_messages,
+            policy_sender,
+            unknown_users,
+            reload_fifo,
+            limits_generation,
+            config["sleep_time"],
+        )
+        exit_code = 1
+    except KeyboardInterrupt:
+        exit_code = 0
+    finally:
+        for worker_process in workers:
+            worker_process.terminate()
+        for worker_process in workers:
+            worker_process.join()
+        log_listener.stop()
+    return exit_code
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(main(args.config_file))
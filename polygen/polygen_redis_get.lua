@@ -1,11 +1,39 @@
 -- Copyright 2024 Bloomberg Finance L.P.
 -- Distributed under the terms of the Apache 2.0 license.
+-- ARGV[1] and ARGV[2] are optional lower bounds on every user-level request-rate and bandwidth limit (in bytes)
+-- respectively. A usage value below the relevant bound can't be violating any limit, so we leave it out of the
+-- result rather than send it back to polygen just for it to be ignored.
+local min_rate_limit = tonumber(ARGV[1])
+local min_bnd_limit = tonumber(ARGV[2])
+
+local function filter_usage(key, fields)
+    if min_rate_limit == nil or min_bnd_limit == nil or string.find(key, "^verb_%d+_user_") == nil then
+        return fields
+    end
+    local filtered = {}
+    local num_fields = table.getn(fields)
+    for j = 1,num_fields,2 do
+        local field = fields[j]
+        local min_limit = min_rate_limit
+        if field == "bnd_up" or field == "bnd_dwn" then
+            min_limit = min_bnd_limit
+        elseif string.find(field, "bnd", 1, true) then
+            min_limit = 0
+        end
+        if tonumber(fields[j + 1]) >= min_limit then
+            table.insert(filtered, field)
+            table.insert(filtered, fields[j + 1])
+        end
+    end
+    return filtered
+end
+
 local result = {}
 local num_keys = table.getn(KEYS)
 for i = 1,num_keys,1 do
     if string.sub(KEYS[i], 1, 4) == "verb" then
         local fields = redis.call('hgetall', KEYS[i])
-        table.insert(result, fields)
+        table.insert(result, filter_usage(KEYS[i], fields))
     elseif string.sub(KEYS[i], 1, 4) == "conn" then
         -- We're in the process  of migrating the API here,
         -- in the old API connections were stored as a set of keys (one per connection)
@@ -6,13 +6,14 @@ import argparse
 import logging
 import logging.handlers
 import multiprocessing
-import queue
+import multiprocessing.connection
 import re
 import sys
 import time
-from collections import deque
+from collections import defaultdict, deque
 from typing import TYPE_CHECKING, Any, NamedTuple, NoReturn, cast
 
+import msgpack  # type: ignore
 import prometheus_client
 import redis
 import yaml
@@ -29,12 +30,11 @@ logger = logging.getLogger("qos_metrics_exposer")
 if TYPE_CHECKING:
     DataPoints = dict[int, dict[str, list[tuple[int, dict[str, str]]]]]
 
-    MetricsQueue = multiprocessing.Queue[DataPoints]
-
 
 class PrometheusExposingMetrics(NamedTuple):
     gauge: Gauge
-    cleanup_q: deque
+    # The label values of each sample we've set, in the order they were set
+    cleanup_q: deque[tuple[str, ...]]
 
 
 def init_logger(filename: str, log_level: str) -> None:
@@ -60,24 +60,36 @@ def init_logger(filename: str, log_level: str) -> None:
         logging.exception(f"failed to create logger: {ex}")
 
 
+# How many keys we ask redis to look at in each SCAN call. Much larger than redis' default of 10
+# so that we don't need thousands of round-trips to get through all of the keys.
+REDIS_SCAN_COUNT = 5000
+
+# We only use redis from the one process, so there's no need for more connections than this
+REDIS_MAX_CONNECTIONS = 8
+
+
 #
 # gathering data from redis-qos and creating metrics datapoints out of them
 #
+def new_epoch_datapoints() -> dict[str, list[tuple[int, dict[str, str]]]]:
+    return {
+        Metric.READ_THRU: [],
+        Metric.WRITE_THRU: [],
+        Metric.IO_CNT_PER_VERB: [],
+        Metric.CONNECTIONS: [],
+    }
+
+
 def process_data_retrieved_from_redis(metrics: list[UserLevelUsage]) -> "DataPoints":
-    datapoints: "DataPoints" = {}
+    datapoints: "DataPoints" = defaultdict(new_epoch_datapoints)
 
     per_user_metrics = MetricService.merge_metrics_by_key(metrics)
     for metric in per_user_metrics:
-        if metric.epoch not in datapoints:
-            datapoints[metric.epoch] = {
-                Metric.READ_THRU: [],
-                Metric.WRITE_THRU: [],
-                Metric.IO_CNT_PER_VERB: [],
-                Metric.CONNECTIONS: [],
-            }
         metric.load_data_into_datapoints(datapoints)
 
-    return datapoints
+    # Hand back a plain dict, so that the publisher doesn't get new epochs made up for it
+    # when it looks one up
+    return dict(datapoints)
 
 
 def retrieve_data_from_redis(
@@ -87,21 +99,17 @@ def retrieve_data_from_redis(
     _epochs_found = set()
 
     # retrieve keys from redis-qos
+    # We SCAN rather than using KEYS so that we don't block redis while it goes through every key.
+    # SCAN is permitted to return duplicates, so we need to filter those out.
+    # The connection decodes responses for us, so the keys are already strings.
     # We're not using asyncio, so we don't care about the Awaitable case
-    encoded_redis_keys = cast(Any, rs_conn.keys("*_user_*"))
-    decoded_redis_keys: list[str] = []
-    for encoded_key in encoded_redis_keys:
-        try:
-            decoded_redis_keys.append(encoded_key.decode())
-        except Exception as ex:
-            logger.warning(
-                f"failed to decode a redis key '{encoded_key!r}': {ex}"
-            )  # type:ignore
-            continue
+    redis_keys: set[str] = set(
+        cast(Any, rs_conn.scan_iter(match="*_user_*", count=REDIS_SCAN_COUNT))
+    )
 
-    for decoded_key in decoded_redis_keys:  # type:ignore
+    for redis_key in redis_keys:
         try:
-            metric = MetricService.create_user_level_metric(decoded_key, current_epoch)
+            metric = MetricService.create_user_level_metric(redis_key, current_epoch)
             if metric.metric_type == UsageType.VERB:
                 _epochs_found.add(metric.epoch)
             metrics.append(metric)
@@ -125,28 +133,70 @@ def retrieve_data_from_redis(
         f"curr_time={time.time():.1f} epochs_found={epochs_found} epochs_to_exclude={excluded_epochs}"
     )
 
+    metrics = [
+        metric
+        for metric in metrics
+        if metric.metric_type != UsageType.VERB or metric.epoch in epochs_found
+    ]
+
+    # Fetch the data for all of the metrics in a single round-trip
+    pipe = rs_conn.pipeline(transaction=False)
     for metric in metrics:
-        if metric.metric_type == UsageType.VERB and metric.epoch not in epochs_found:
-            metrics.remove(metric)
-            continue
+        metric.queue_load_from_redis(pipe)
+    replies = pipe.execute(raise_on_error=False)
 
+    loaded_metrics: list[UserLevelUsage] = []
+    for metric, reply in zip(metrics, replies):
         try:
-            metric.load_data_from_redis(rs_conn)
+            if isinstance(reply, Exception):
+                raise reply
+            metric.load_data_from_reply(reply)
         except Exception as ex:
             logger.warning(f"failed to load data from redis for {metric}", exc_info=ex)
-            metrics.remove(metric)
+            continue
+        loaded_metrics.append(metric)
+
+    return loaded_metrics
 
-    return metrics
+
+def send_datapoints(
+    metrics_sender: multiprocessing.connection.Connection, datapoints: "DataPoints"
+) -> None:
+    # msgpack encodes our datapoints more compactly and several times faster than the pickling
+    # that Connection.send would do
+    metrics_sender.send_bytes(msgpack.packb(datapoints))
+
+
+def receive_datapoints(
+    metrics_receiver: multiprocessing.connection.Connection,
+) -> "DataPoints":
+    # The epochs are the keys of the outer dict, which msgpack only allows for if we ask it to.
+    # The (value, tags) tuples come back as lists, but we only ever unpack them anyway.
+    return msgpack.unpackb(  # type: ignore
+        metrics_receiver.recv_bytes(), strict_map_key=False
+    )
 
 
 #
 # main process that handles gathering data from redis-qos
 #
 def get_redis_server_connection(redis_server: str) -> redis.Redis:
+    host, port = redis_server.split(":")
+    # Every round goes through this one pool, so we keep reusing the same connections
+    # rather than connecting again each time we retry
+    pool = redis.ConnectionPool(
+        host=host,
+        port=int(port),
+        db=0,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        # Have redis-py decode every response as it parses it, rather than us decoding each key ourselves.
+        # Any key that isn't valid UTF-8 will then fail to parse as a metric key, and get skipped then.
+        decode_responses=True,
+        encoding_errors="replace",
+    )
     while True:
         try:
-            host, port = redis_server.split(":")
-            rs_conn = redis.Redis(host=host, port=int(port), db=0)
+            rs_conn = redis.Redis(connection_pool=pool)
             if not rs_conn.ping():
                 raise Exception("connection established but redis is not pinging")
             return rs_conn
@@ -156,10 +206,11 @@ def get_redis_server_connection(redis_server: str) -> redis.Redis:
 
 
 MIN_SLEEP_TIME_SEC_PER_ROUND = 0.1  # 100 msec
+NSECS_IN_SEC = 1_000_000_000
 
 
 def redis_consumer_process(
-    metrics_queue: "MetricsQueue", redis_server: str
+    metrics_sender: multiprocessing.connection.Connection, redis_server: str
 ) -> NoReturn:
     rs_conn: redis.Redis | None = None
 
@@ -167,21 +218,27 @@ def redis_consumer_process(
 
     while True:
         try:
-            if rs_conn is None or not rs_conn.ping():
+            # We don't ping on every round, since we'll find out that the connection has gone
+            # from the round itself failing, and will then reconnect on the next one
+            if rs_conn is None:
                 rs_conn = get_redis_server_connection(redis_server)
 
-            start_time = time.time()
-            start_epoch = int(start_time)
+            start_ns = time.time_ns()
+            start_epoch = start_ns // NSECS_IN_SEC
 
             redis_data = retrieve_data_from_redis(rs_conn, start_epoch)
             if len(redis_data) > 0:
-                metrics_queue.put(process_data_retrieved_from_redis(redis_data))
+                send_datapoints(
+                    metrics_sender, process_data_retrieved_from_redis(redis_data)
+                )
 
-            end_time = time.time()
-            end_epoch = int(end_time)
-            elapsed_time = end_time - start_time
+            end_ns = time.time_ns()
+            end_epoch = end_ns // NSECS_IN_SEC
+            elapsed_time = (end_ns - start_ns) / NSECS_IN_SEC
             if start_epoch == end_epoch:
-                time_sec_till_next_epoch = max(0, end_epoch + 1 - end_time)
+                time_sec_till_next_epoch = (
+                    (end_epoch + 1) * NSECS_IN_SEC - end_ns
+                ) / NSECS_IN_SEC
             else:
                 time_sec_till_next_epoch = 0
 
@@ -190,8 +247,11 @@ def redis_consumer_process(
                     MIN_SLEEP_TIME_SEC_PER_ROUND, time_sec_till_next_epoch * 0.25
                 )
                 logger.debug(
-                    f"round did not find metrics data after elapsed_time={elapsed_time:.3f} seconds "
-                    f"curr_time={end_time:.1f} check again in sleep_for={sleep_time:.3f} seconds"
+                    "round did not find metrics data after elapsed_time=%.3f seconds "
+                    "curr_time=%.1f check again in sleep_for=%.3f seconds",
+                    elapsed_time,
+                    end_ns / NSECS_IN_SEC,
+                    sleep_time,
                 )
                 time.sleep(sleep_time)
             else:
@@ -203,6 +263,8 @@ def redis_consumer_process(
                 )
                 time.sleep(sleep_time)
         except Exception:
+            if rs_conn is not None:
+                rs_conn.connection_pool.disconnect()
             rs_conn = None
             logger.exception("failed to process redis data")
 
@@ -219,13 +281,22 @@ def process_datapoints_into_metrics(
     gauges: dict[str, PrometheusExposingMetrics], datapoints: "DataPoints"
 ) -> int:
     latest_epoch_seen = 0
+    label_names_by_type = {mtype: labels_by_metric_type(mtype) for mtype in gauges}
     for epoch, metrics in datapoints.items():
+        epoch_str = str(epoch)
         for metric_type, values in metrics.items():
+            if not values:
+                continue
+            latest_epoch_seen = max(latest_epoch_seen, epoch)
+            pem = gauges[metric_type]
+            label_names = label_names_by_type[metric_type]
             for value, tags in values:
-                tags["epoch"] = str(epoch)
-                latest_epoch_seen = max(latest_epoch_seen, epoch)
-                gauges[metric_type].gauge.labels(**tags).set(value)
-                gauges[metric_type].cleanup_q.append(dict(tags))
+                tags["epoch"] = epoch_str
+                # Passing the label values positionally saves prometheus_client from having to
+                # put them in order itself, and the tuple is all we need to remove the sample later
+                label_values = tuple(tags[label] for label in label_names)
+                pem.gauge.labels(*label_values).set(value)
+                pem.cleanup_q.append(label_values)
     return latest_epoch_seen
 
 
@@ -234,20 +305,22 @@ def cleanup_old_metrics(
 ) -> None:
     oldest_metric_age_sec = 5
     for mtype, pem in gauges.items():
+        epoch_index = labels_by_metric_type(mtype).index("epoch")
         while len(pem.cleanup_q) > 0:
-            next_metric_epoch = int(pem.cleanup_q[0]["epoch"])
+            next_metric_epoch = int(pem.cleanup_q[0][epoch_index])
             if latest_epoch_seen - next_metric_epoch <= oldest_metric_age_sec:
                 break
-            label_values = pem.cleanup_q.popleft()
-            try:
-                pem.gauge.remove(
-                    *[label_values[label] for label in labels_by_metric_type(mtype)]
-                )
-            except KeyError:
-                pass
+            # Gauge.remove ignores samples that are already gone
+            pem.gauge.remove(*pem.cleanup_q.popleft())
 
 
-def run_publisher_process(metrics_queue: "MetricsQueue") -> None:
+def run_publisher_process(
+    metrics_receiver: multiprocessing.connection.Connection,
+    metrics_sender: multiprocessing.connection.Connection,
+) -> None:
+    # We only ever receive. Holding on to our copy of the sending end would stop us from seeing EOF
+    # when the redis consumer goes away, since the pipe would still have a writer: us.
+    metrics_sender.close()
     logger.info("metrics publisher starting")
 
     guages_clear_timeout_sec = 5
@@ -284,12 +357,17 @@ def run_publisher_process(metrics_queue: "MetricsQueue") -> None:
 
     latest_epoch_seen = 0
     while True:
-        try:
-            datapoints = metrics_queue.get(timeout=guages_clear_timeout_sec)
-        except queue.Empty:
+        if not metrics_receiver.poll(guages_clear_timeout_sec):
             for pem in gauges.values():
                 pem.gauge.clear()
             continue
+        try:
+            datapoints = receive_datapoints(metrics_receiver)
+        except EOFError:
+            logger.error(
+                "redis consumer has gone away, so there's nothing left to publish"
+            )
+            return
         try:
             if not datapoints:
                 continue
@@ -307,12 +385,16 @@ def run_publisher_process(metrics_queue: "MetricsQueue") -> None:
 
 
 def main(qos_redis_server: str) -> None:
-    metrics_queue: "MetricsQueue" = multiprocessing.Queue()
+    # There's only the one producer and the one consumer, so a plain pipe is all we need. Unlike a
+    # multiprocessing.Queue, it doesn't need a feeder thread and lock to hand each set of datapoints over.
+    metrics_receiver, metrics_sender = multiprocessing.Pipe(duplex=False)
     publisher_process = multiprocessing.Process(
-        target=run_publisher_process, args=(metrics_queue,)
+        target=run_publisher_process, args=(metrics_receiver, metrics_sender)
     )
     publisher_process.start()
-    redis_consumer_process(metrics_queue, qos_redis_server)
+    # Likewise, the receiving end is the publisher's alone
+    metrics_receiver.close()
+    redis_consumer_process(metrics_sender, qos_redis_server)
 
 
 def load_config_file(config_file: str) -> dict[str, Any]:
@@ -17,6 +17,13 @@ from requests.exceptions import Timeout
 
 logger = logging.getLogger("qos_metrics_publisher")
 
+MAX_WAIT_SECS_AFTER_FAILURE = 60
+# How long to wait after each consecutive failure to poll the exposer: doubling each time, up to the maximum
+BACKOFF_SECS_AFTER_FAILURE = tuple(
+    min(pow(2, try_count), MAX_WAIT_SECS_AFTER_FAILURE)
+    for try_count in range(1, math.ceil(math.log2(MAX_WAIT_SECS_AFTER_FAILURE)) + 1)
+)
+
 if TYPE_CHECKING:
     Metric = tuple[float, dict[str, str]]
     MetricsDict = dict[str, list[Metric]]
@@ -52,23 +59,27 @@ class Publisher:
     EPOCHS_PROCESSED_SET_MAX_ELEMS = 10
 
     def __init__(self) -> None:
-        self.metrics_processed: dict[str, list[int]] = defaultdict(list)
+        # The latest epochs processed for each metric, kept in a set so that checking for one doesn't need a scan
+        self.metrics_processed: dict[str, set[int]] = defaultdict(set)
 
     def publish_metrics(self, metrics: "MetricsDict", epoch: int) -> None:
         for metric_name in list(metrics.keys()):
-            if epoch in self.metrics_processed[metric_name]:
+            timestamps = self.metrics_processed[metric_name]
+            if epoch in timestamps:
                 del metrics[metric_name]
             else:
-                self.metrics_processed[metric_name].append(epoch)
-
+                timestamps.add(epoch)
+                # Epochs can arrive out of order, so it's the earliest one we forget, not the first one we saw
+                if len(timestamps) > self.EPOCHS_PROCESSED_SET_MAX_ELEMS:
+                    timestamps.remove(min(timestamps))
+
+        # Checked once up front, rather than formatting a message for every value only to drop it
+        if not logger.isEnabledFor(logging.INFO):
+            return
         for metric_name, metric_values in metrics.items():
-            logger.info(f"publishing metrics: {metric_name} for epoch: {epoch}")
+            logger.info("publishing metrics: %s for epoch: %s", metric_name, epoch)
             for val in metric_values:
-                logger.info(f"value: {val[0]}, tags: {val[1]}")
-
-        for metric_name, timestamps in self.metrics_processed.items():
-            if len(timestamps) > self.EPOCHS_PROCESSED_SET_MAX_ELEMS:
-                timestamps.remove(min(timestamps))
+                logger.info("value: %s, tags: %s", val[0], val[1])
 
 
 def poll_metrics() -> None:
@@ -76,34 +87,41 @@ def poll_metrics() -> None:
 
     request_timeout = 60
     qos_metrics_publishing_period_sec = 1
-    max_wait_secs_after_failure = 60
-    max_try_count_after_failure = math.ceil(math.log2(max_wait_secs_after_failure))
     try_count = 0
 
     publisher = Publisher()
     datapoints: "DataPoints" = defaultdict(lambda: defaultdict(list))
+    # Keep the connection to the exposer alive between polls rather than reconnecting every time
+    session = requests.Session()
 
     while True:
         try:
-            response = requests.get(PROMETHEUS_EXPOSER, timeout=request_timeout)
-            if response.status_code != 200:
-                raise Exception(
-                    f"unexpected response code '{response.status_code}': {response}"
+            with session.get(
+                PROMETHEUS_EXPOSER, timeout=request_timeout, stream=True
+            ) as response:
+                if response.status_code != 200:
+                    raise Exception(
+                        f"unexpected response code '{response.status_code}': {response}"
+                    )
+
+                # Parse the metrics as they arrive, rather than holding onto the whole response first
+                if response.encoding is None:
+                    response.encoding = "utf-8"
+                prom_metrics = parser.text_fd_to_metric_families(
+                    response.iter_lines(decode_unicode=True)  # type: ignore
                 )
-
-            prom_metrics = parser.text_string_to_metric_families(response.text)
-            for m in prom_metrics:
-                for s in m.samples:
-                    tags = dict(s.labels)
-                    epoch = int(tags["epoch"])
-                    datapoints[epoch][m.name].append((s.value, tags))
+                for m in prom_metrics:
+                    for s in m.samples:
+                        tags = dict(s.labels)
+                        epoch = int(tags["epoch"])
+                        datapoints[epoch][m.name].append((s.value, tags))
         except Timeout:
             logger.error(f"query to {PROMETHEUS_EXPOSER} timed out. Try again.")
             continue
         except Exception as ex:
-            try_count = min(try_count + 1, max_try_count_after_failure)
+            try_count = min(try_count + 1, len(BACKOFF_SECS_AFTER_FAILURE))
             logger.exception(f"query failed to {PROMETHEUS_EXPOSER}: {ex}")
-            time.sleep(min(pow(2, try_count), max_wait_secs_after_failure))
+            time.sleep(BACKOFF_SECS_AFTER_FAILURE[try_count - 1])
             continue
         else:
             try_count = 0
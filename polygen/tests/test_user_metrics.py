@@ -1,26 +1,27 @@
 # Copyright 2024 Bloomberg Finance L.P.
 # Distributed under the terms of the Apache 2.0 license.
 import unittest
+from unittest.mock import Mock
 
-from weir.models.user_metrics import UserLevelUsage, UserLevelVerbUsage
+from weir.models.user_metrics import UserLevelActiveRequestsUsage
 
 
 class TestUserMetrics(unittest.TestCase):
-    def test__decode_redis_data_successfully_decodes_none_to_none(self) -> None:
-        input_data = None
-        output = UserLevelUsage.decode_redis_data(input_data)
-        self.assertEqual(output, None)
+    def test__load_data_from_redis_uses_the_reply_to_the_queued_command(
+        self,
+    ) -> None:
+        pipe = Mock()
+        pipe.execute.return_value = [b"7"]
+        rs_conn = Mock()
+        rs_conn.pipeline.return_value = pipe
+        metric = UserLevelActiveRequestsUsage(
+            "conn_v2_user_up_instance1234_AKIAIOSFODNN7EXAMPLE$dev", 123
+        )
 
-    def test__decode_redis_data_successfully_decodes_bytes_to_string(self) -> None:
-        input_data = b"qweasd"
-        output = UserLevelUsage.decode_redis_data(input_data)
-        self.assertIsInstance(output, str)
-        self.assertEqual(output, "qweasd")
+        metric.load_data_from_redis(rs_conn)
 
-    def test__decode_redis_data_throws_when_decoding_a_custom_type(self) -> None:
-        input_data = UserLevelVerbUsage("key", 1234, "account$key")
-        with self.assertRaises(Exception):
-            UserLevelUsage.decode_redis_data(input_data)
+        pipe.get.assert_called_once_with(metric.key)
+        self.assertEqual(metric.data, 7)
 
 
 if __name__ == "__main__":
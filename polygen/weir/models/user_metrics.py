@@ -1,8 +1,9 @@
 # Copyright 2024 Bloomberg Finance L.P.
 # Distributed under the terms of the Apache 2.0 license.
+import sys
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import TYPE_CHECKING, Any, no_type_check
+from typing import TYPE_CHECKING, Any
 
 import redis
 
@@ -44,55 +45,67 @@ class UsageValue(Enum):
 
     @staticmethod
     def from_string(s: str) -> "UsageValue":
-        metric_val_dict = {
-            "bnd_up": UsageValue.THRU_TYPE_WRITE,
-            "bnd_dwn": UsageValue.THRU_TYPE_READ,
-            "get": UsageValue.VERB_GET,
-            "put": UsageValue.VERB_PUT,
-            "post": UsageValue.VERB_POST,
-            "delete": UsageValue.VERB_DELETE,
-            "listobjectsv2": UsageValue.VERB_LISTOBJECTSV2,
-            "listmultipartuploads": UsageValue.VERB_LISTMULTIPARTUPLOADS,
-            "listobjectversions": UsageValue.VERB_LISTOBJECTVERSIONS,
-            "listbuckets": UsageValue.VERB_LISTBUCKETS,
-            "listobjects": UsageValue.VERB_LISTOBJECTS,
-            "getobject": UsageValue.VERB_GETOBJECT,
-            "deleteobjects": UsageValue.VERB_DELETEOBJECTS,
-            "deleteobject": UsageValue.VERB_DELETEOBJECT,
-            "createbucket": UsageValue.VERB_CREATEBUCKET,
-            "head": UsageValue.VERB_HEAD,
-            "reqs_block": UsageValue.REQUESTS_BLOCK,
-            "reqs_unblock": UsageValue.REQUESTS_UNBLOCK,
-        }
-
-        return metric_val_dict[s.lower()]
+        return _USAGE_VALUES_BY_STRING[s.lower()]
 
     @staticmethod
-    def verb_values() -> list["UsageValue"]:
-        return [
-            UsageValue.VERB_GET,
-            UsageValue.VERB_PUT,
-            UsageValue.VERB_POST,
-            UsageValue.VERB_DELETE,
-            UsageValue.VERB_HEAD,
-            UsageValue.VERB_LISTOBJECTSV2,
-            UsageValue.VERB_LISTMULTIPARTUPLOADS,
-            UsageValue.VERB_LISTOBJECTVERSIONS,
-            UsageValue.VERB_LISTBUCKETS,
-            UsageValue.VERB_LISTOBJECTS,
-            UsageValue.VERB_GETOBJECT,
-            UsageValue.VERB_DELETEOBJECTS,
-            UsageValue.VERB_DELETEOBJECT,
-            UsageValue.VERB_CREATEBUCKET,
-        ]
+    def verb_values() -> tuple["UsageValue", ...]:
+        return VERB_VALUES
 
     @staticmethod
-    def throughput_values() -> list["UsageValue"]:
-        return [UsageValue.THRU_TYPE_WRITE, UsageValue.THRU_TYPE_READ]
+    def throughput_values() -> tuple["UsageValue", ...]:
+        return THROUGHPUT_VALUES
 
     @staticmethod
-    def requests_values() -> list["UsageValue"]:
-        return [UsageValue.REQUESTS_BLOCK, UsageValue.REQUESTS_UNBLOCK]
+    def requests_values() -> tuple["UsageValue", ...]:
+        return REQUESTS_VALUES
+
+
+# Built once for from_string, which is called for every violating field in every verb key
+_USAGE_VALUES_BY_STRING = {
+    "bnd_up": UsageValue.THRU_TYPE_WRITE,
+    "bnd_dwn": UsageValue.THRU_TYPE_READ,
+    "get": UsageValue.VERB_GET,
+    "put": UsageValue.VERB_PUT,
+    "post": UsageValue.VERB_POST,
+    "delete": UsageValue.VERB_DELETE,
+    "listobjectsv2": UsageValue.VERB_LISTOBJECTSV2,
+    "listmultipartuploads": UsageValue.VERB_LISTMULTIPARTUPLOADS,
+    "listobjectversions": UsageValue.VERB_LISTOBJECTVERSIONS,
+    "listbuckets": UsageValue.VERB_LISTBUCKETS,
+    "listobjects": UsageValue.VERB_LISTOBJECTS,
+    "getobject": UsageValue.VERB_GETOBJECT,
+    "deleteobjects": UsageValue.VERB_DELETEOBJECTS,
+    "deleteobject": UsageValue.VERB_DELETEOBJECT,
+    "createbucket": UsageValue.VERB_CREATEBUCKET,
+    "head": UsageValue.VERB_HEAD,
+    "reqs_block": UsageValue.REQUESTS_BLOCK,
+    "reqs_unblock": UsageValue.REQUESTS_UNBLOCK,
+}
+
+# These are checked for every metric and violation, so they're built once rather than on every call.
+# They're tuples rather than sets because Enum hashes its members in Python, so for so few members,
+# comparing them by identity is faster than hashing them.
+VERB_VALUES = (
+    UsageValue.VERB_GET,
+    UsageValue.VERB_PUT,
+    UsageValue.VERB_POST,
+    UsageValue.VERB_DELETE,
+    UsageValue.VERB_HEAD,
+    UsageValue.VERB_LISTOBJECTSV2,
+    UsageValue.VERB_LISTMULTIPARTUPLOADS,
+    UsageValue.VERB_LISTOBJECTVERSIONS,
+    UsageValue.VERB_LISTBUCKETS,
+    UsageValue.VERB_LISTOBJECTS,
+    UsageValue.VERB_GETOBJECT,
+    UsageValue.VERB_DELETEOBJECTS,
+    UsageValue.VERB_DELETEOBJECT,
+    UsageValue.VERB_CREATEBUCKET,
+)
+THROUGHPUT_VALUES = (UsageValue.THRU_TYPE_WRITE, UsageValue.THRU_TYPE_READ)
+REQUESTS_VALUES = (UsageValue.REQUESTS_BLOCK, UsageValue.REQUESTS_UNBLOCK)
+# The field names verb counts are stored under in redis. Strings hash in C, so a set is the quick way to pick
+# them out of a metric's data.
+_VERB_VALUE_STRINGS = frozenset(v.value for v in VERB_VALUES)
 
 
 class Metric:
@@ -104,17 +117,38 @@ class Metric:
 
 
 class UserLevelUsage(ABC):
-    key: str = ""
-    epoch: int = 0
-    access_key: str = ""
+    # We create one of these for every key we find in redis each round,
+    # so avoid giving each of them a __dict__
+    __slots__ = ("key", "epoch", "access_key", "endpoint")
+
+    key: str
+    epoch: int
+    access_key: str
+    endpoint: str
     metric_type: UsageType = UsageType.UNKNOWN
-    endpoint: str = ""
     scope: UsageScope = UsageScope.USER_LEVEL
 
     @abstractmethod
-    def load_data_from_redis(self, rs_conn: redis.Redis) -> None:
+    def queue_load_from_redis(self, pipe: redis.client.Pipeline) -> None:
+        """
+        Queues the command that fetches this metric's data on the given pipeline.
+        Its reply should be passed to load_data_from_reply once the pipeline has been executed.
+        """
+        pass
+
+    @abstractmethod
+    def load_data_from_reply(self, reply: Any) -> None:
+        """
+        Expects the reply from a client created with decode_responses=True, so that the redis parser
+        has already decoded it for us.
+        """
         pass
 
+    def load_data_from_redis(self, rs_conn: redis.Redis) -> None:
+        pipe = rs_conn.pipeline(transaction=False)
+        self.queue_load_from_redis(pipe)
+        self.load_data_from_reply(pipe.execute()[0])
+
     @abstractmethod
     def load_data_into_datapoints(self, datapoints: "DataPoints") -> None:
         pass
@@ -136,53 +170,34 @@ class UserLevelUsage(ABC):
     def __str__(self) -> str:
         return f"{self.endpoint} {self.scope} {self.access_key}"
 
-    @no_type_check
-    @staticmethod
-    def decode_redis_data(input_redis_data: Any) -> Any:
-        if input_redis_data is None:
-            return None
-        if isinstance(input_redis_data, (str, int)):
-            decoded_redis_data = input_redis_data
-        elif isinstance(input_redis_data, bytes):
-            decoded_redis_data = input_redis_data.decode()
-        elif isinstance(input_redis_data, (list, tuple)):
-            decoded_redis_data = []
-            for i in input_redis_data:
-                decoded_redis_data.append(UserLevelUsage.decode_redis_data(i))
-            if isinstance(input_redis_data, tuple):
-                decoded_redis_data = tuple(decoded_redis_data)
-        elif isinstance(input_redis_data, dict):
-            decoded_redis_data = {}
-            for k, v in input_redis_data.items():
-                decoded_redis_data[UserLevelUsage.decode_redis_data(k)] = (
-                    UserLevelUsage.decode_redis_data(v)
-                )
-        else:
-            raise Exception(
-                f"data {input_redis_data} has unexpected type {type(input_redis_data)}"
-            )
-        return decoded_redis_data
-
 
 class UserLevelVerbUsage(UserLevelUsage):
+    __slots__ = ("data",)
+
+    metric_type = UsageType.VERB
+
     def __init__(self, key: str, epoch: int, acc_key: str) -> None:
         self.epoch = epoch
         self.key = key
-        self.metric_type = UsageType.VERB
         self.data: dict[str, int] = dict()
 
-        if len(acc_key.split("$")) != 2:
+        access_key, separator, endpoint = acc_key.partition("$")
+        if not separator or "$" in endpoint:
             raise Exception(
                 f"invalid user access key and endpoint pair: {acc_key} for {key}"
             )
 
-        self.access_key, self.endpoint = acc_key.split("$")
+        # The same users and endpoints turn up in many keys every round, and we group
+        # metrics by them, so share a single copy of each string
+        self.access_key = sys.intern(access_key)
+        self.endpoint = sys.intern(endpoint)
 
-    def load_data_from_redis(self, rs_conn: redis.Redis) -> None:
-        encoded_data = rs_conn.hgetall(self.key)
-        decoded_data = UserLevelUsage.decode_redis_data(encoded_data)
-        if decoded_data is not None:
-            self.data = decoded_data
+    def queue_load_from_redis(self, pipe: redis.client.Pipeline) -> None:
+        pipe.hgetall(self.key)
+
+    def load_data_from_reply(self, reply: Any) -> None:
+        if reply is not None:
+            self.data = reply
 
     def load_data_into_datapoints(self, datapoints: "DataPoints") -> None:
         if not self.data:
@@ -191,17 +206,23 @@ class UserLevelVerbUsage(UserLevelUsage):
         download_thru = int(self.data.get(UsageValue.THRU_TYPE_READ.value, 0))
         upload_thru = int(self.data.get(UsageValue.THRU_TYPE_WRITE.value, 0))
         tags = self.get_standard_tags()
+        epoch_datapoints = datapoints[self.epoch]
         if download_thru != 0:
-            datapoints[self.epoch][Metric.READ_THRU].append((download_thru, tags))
+            epoch_datapoints[Metric.READ_THRU].append((download_thru, tags))
 
         if upload_thru != 0:
-            datapoints[self.epoch][Metric.WRITE_THRU].append((upload_thru, tags))
-
-        for v in UsageValue.verb_values():
-            verb_io_cnt = int(self.data.get(v.value, 0))
+            epoch_datapoints[Metric.WRITE_THRU].append((upload_thru, tags))
+
+        # Only look at the verbs this user actually used rather than checking for every one of them,
+        # since a metric usually only has a few (or, for throughput-only metrics, none at all)
+        verb_datapoints = epoch_datapoints[Metric.IO_CNT_PER_VERB]
+        for field, value in self.data.items():
+            if field not in _VERB_VALUE_STRINGS:
+                continue
+            verb_io_cnt = int(value)
             if verb_io_cnt != 0:
-                datapoints[self.epoch][Metric.IO_CNT_PER_VERB].append(
-                    (verb_io_cnt, self.add_verb_tag(tags, v.value))
+                verb_datapoints.append(
+                    (verb_io_cnt, {**tags, "httpRequestMethod": field})
                 )
 
     def merge_from(self, other: "UserLevelUsage") -> None:
@@ -209,14 +230,12 @@ class UserLevelVerbUsage(UserLevelUsage):
             "Verb usage merging is not currently supported and should not currently be needed"
         )
 
-    def add_verb_tag(self, tags: dict[str, str], verb: str) -> dict[str, str]:
-        new_tags = dict(tags)
-        new_tags["httpRequestMethod"] = verb
 
-        return new_tags
+class UserLevelActiveRequestsUsage(UserLevelUsage):
+    __slots__ = ("data", "direction", "instance_id")
 
+    metric_type = UsageType.ACTIVE_REQUESTS
 
-class UserLevelActiveRequestsUsage(UserLevelUsage):
     def __init__(self, key: str, epoch: int) -> None:
         """
         Example:
@@ -224,45 +243,58 @@ class UserLevelActiveRequestsUsage(UserLevelUsage):
         """
         self.epoch = epoch
         self.key = key
-        self.metric_type = UsageType.ACTIVE_REQUESTS
         self.data = 0
 
-        items = key.split("_")
-        assert items[0] == "conn"
-        if len(items) < 2:
+        # Partition the key one field at a time rather than splitting it into a list of all of them.
+        # Each key must have exactly as many fields as its version calls for, so the access key
+        # and endpoint pair at the end can't contain any further separators.
+        metric_id, separator, rest = key.partition("_")
+        assert metric_id == "conn"
+        if not separator:
             raise Exception(f"Invalid active-requests key {key}: Key too short")
 
-        if items[1] == "user":
-            if len(items) != 3:
+        version, separator, rest = rest.partition("_")
+        if version == "user":
+            if not separator or "_" in rest:
                 raise Exception(f"Invalid v1 active-requests key {key}")
             self.direction = None
             self.instance_id = None
-            acc_key = items[2]
-        elif items[1] == "v2":
-            if not (len(items) == 6 and items[2] == "user"):
+            acc_key = rest
+        elif version == "v2":
+            scope, _, rest = rest.partition("_")
+            direction, _, rest = rest.partition("_")
+            instance_id, separator, acc_key = rest.partition("_")
+            if not (separator and "_" not in acc_key and scope == "user"):
                 raise Exception(f"Invalid v2 active-requests key {key}")
-            self.direction = items[3]
-            self.instance_id = items[4]
-            acc_key = items[5]
+            self.direction = sys.intern(direction)
+            self.instance_id = sys.intern(instance_id)
         else:
             raise Exception(f"Invalid active-requests key {key}: Unrecognised version")
 
-        if len(acc_key.split("$")) != 2:
+        access_key, separator, endpoint = acc_key.partition("$")
+        if not separator or "$" in endpoint:
             raise Exception(
                 f"invalid user accesskey and endpoint pair: {acc_key} for {key}"
             )
 
-        self.access_key, self.endpoint = acc_key.split("$")
+        # Interned for the same reason as in UserLevelVerbUsage
+        self.access_key = sys.intern(access_key)
+        self.endpoint = sys.intern(endpoint)
 
-    def load_data_from_redis(self, rs_conn: redis.Redis) -> None:
+    def queue_load_from_redis(self, pipe: redis.client.Pipeline) -> None:
         # If we have an instance-id then we're using the new format
+        if self.instance_id:
+            pipe.get(self.key)
+        else:
+            pipe.scard(self.key)
+
+    def load_data_from_reply(self, reply: Any) -> None:
         if self.instance_id:
             # We might get None back from redis if the key doesn't exist/has been deleted by the time we get here
-            decoded_data = UserLevelUsage.decode_redis_data(rs_conn.get(self.key))
-            if decoded_data is not None:
-                self.data = int(decoded_data)
+            if reply is not None:
+                self.data = int(reply)
         else:
-            self.data = UserLevelUsage.decode_redis_data(rs_conn.scard(self.key))
+            self.data = reply
 
     def load_data_into_datapoints(self, datapoints: "DataPoints") -> None:
         if self.data != 0:
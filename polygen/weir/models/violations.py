@@ -1,70 +1,114 @@
 # Copyright 2024 Bloomberg Finance L.P.
 # Distributed under the terms of the Apache 2.0 license.
 from collections import defaultdict
+from operator import attrgetter
 from typing import KeysView
 
-from .user_metrics import UsageScope, UsageValue, UserLevelUsage
+from .user_metrics import (
+    REQUESTS_VALUES,
+    THROUGHPUT_VALUES,
+    UsageScope,
+    UsageValue,
+    UserLevelUsage,
+)
 
 USECS_IN_SEC = 1_000_000
+# Violation messages for an endpoint are generated in the order the usage values are declared in
+_USAGE_VALUE_ORDER = {usage_value: i for i, usage_value in enumerate(UsageValue)}
 
 
 class UserLevelViolation:
+    # Every endpoint with violations gets its own set of these each epoch, so avoid giving each a __dict__
+    __slots__ = ("scope", "key_states", "new_count", "usage_value", "order", "type_tag")
+
     def __init__(self, usage_value: UsageValue) -> None:
         self.scope: UsageScope = UsageScope.USER_LEVEL
-        self.new_keys: set[str] = set()
-        self.sent_keys: set[str] = set()
-        self.violation_ratios: dict[str, float] = dict()
+        # Each access key in violation maps to whether it has been sent yet, along with its latest
+        # diff ratio, so that recording a violation only has to look the key up once
+        self.key_states: dict[str, tuple[bool, float | None]] = dict()
+        self.new_count = 0
         self.usage_value = usage_value
+        self.order = _USAGE_VALUE_ORDER[usage_value]
+        # Identifies the kind of violation in every message we generate, e.g. user_GET
+        self.type_tag = f"{self.scope.value}_{usage_value.value}"
 
     def add_new_key(
-        self, key: str, diff_ratio: float | None = None, remove_sent: bool = False
+        self,
+        key: str,
+        diff_ratio: float | None = None,
+        state: tuple[bool, float | None] | None = None,
     ) -> None:
-        self.new_keys.add(key)
-        if diff_ratio:
-            self.violation_ratios[key] = diff_ratio
-        if remove_sent:
-            self.sent_keys.remove(key)
-
-    def generate_violation_message(self, epoch_time: float) -> str:
-        if self.usage_value in UsageValue.throughput_values():
-            return self._generate_bnd_violation_message(epoch_time)
-        elif self.usage_value in UsageValue.requests_values():
-            return self._generate_reqs_violation_message()
+        """
+        Marks key as needing to be sent, given its current state if it already has one.
+        """
+        if state is None:
+            self.new_count += 1
         else:
-            return self._generate_verb_violation_message(epoch_time)
-
-    def _generate_verb_violation_message(self, epoch_time: float) -> str:
-        return ",".join(
-            [
-                str(int(epoch_time * USECS_IN_SEC)),
-                "_".join([self.scope.value, self.usage_value.value]),
-                ",".join(self.new_keys),
-            ]
-        )
+            sent, sent_diff_ratio = state
+            if sent:
+                self.new_count += 1
+            if not diff_ratio:
+                diff_ratio = sent_diff_ratio
+        self.key_states[key] = (False, diff_ratio)
+
+    def take_new_keys(self) -> list[tuple[str, float | None]]:
+        """
+        Returns the keys (and their diff ratios) that haven't been sent yet and marks them as sent.
+        """
+        new_keys = [
+            (key, diff_ratio)
+            for key, (sent, diff_ratio) in self.key_states.items()
+            if not sent
+        ]
+        for key, diff_ratio in new_keys:
+            self.key_states[key] = (True, diff_ratio)
+        self.new_count = 0
+        return new_keys
+
+    def generate_violation_message(self, epoch_usec: str) -> str:
+        new_keys = self.take_new_keys()
+        if self.usage_value in THROUGHPUT_VALUES:
+            return self._generate_bnd_violation_message(epoch_usec, new_keys)
+        elif self.usage_value in REQUESTS_VALUES:
+            return self._generate_reqs_violation_message(new_keys)
+        else:
+            return self._generate_verb_violation_message(epoch_usec, new_keys)
 
-    def _generate_bnd_violation_message(self, epoch_time: float) -> str:
-        return ",".join(
-            [
-                str(int(epoch_time * USECS_IN_SEC)),
-                "_".join([self.scope.value, self.usage_value.value]),
-                ",".join((f"{k}:{self.violation_ratios[k]}" for k in self.new_keys)),
-            ]
-        )
+    def _generate_verb_violation_message(
+        self, epoch_usec: str, new_keys: list[tuple[str, float | None]]
+    ) -> str:
+        keys = ",".join(k for k, _ in new_keys)
+        return f"{epoch_usec},{self.type_tag},{keys}"
 
-    def _generate_reqs_violation_message(self) -> str:
-        return ",".join(
-            [
-                "_".join([self.scope.value, self.usage_value.value]),
-                ",".join(self.new_keys),
-            ]
-        )
+    def _generate_bnd_violation_message(
+        self, epoch_usec: str, new_keys: list[tuple[str, float | None]]
+    ) -> str:
+        keys = ",".join(f"{k}:{diff_ratio}" for k, diff_ratio in new_keys)
+        return f"{epoch_usec},{self.type_tag},{keys}"
+
+    def _generate_reqs_violation_message(
+        self, new_keys: list[tuple[str, float | None]]
+    ) -> str:
+        keys = ",".join(k for k, _ in new_keys)
+        return f"{self.type_tag},{keys}"
 
 
 class EndpointViolations:
+    __slots__ = ("violations",)
+
     def __init__(self) -> None:
+        # Most endpoints only see a few kinds of violation, so each one is only created once it's needed
         self.violations: dict[UsageValue, UserLevelViolation] = dict()
-        for usage_value in UsageValue:
-            self.violations[usage_value] = UserLevelViolation(usage_value)
+
+    def get(self, usage_value: UsageValue) -> UserLevelViolation:
+        violation = self.violations.get(usage_value)
+        if violation is None:
+            violation = UserLevelViolation(usage_value)
+            self.violations[usage_value] = violation
+        return violation
+
+    def in_order(self) -> list[UserLevelViolation]:
+        return sorted(self.violations.values(), key=attrgetter("order"))
 
 
 class Violations:
@@ -79,7 +123,7 @@ class Violations:
 
     def __init__(self) -> None:
         self.endpoint_violations: dict[str, EndpointViolations] = defaultdict(
-            lambda: EndpointViolations()
+            EndpointViolations
         )
 
     def add_violation(
@@ -88,30 +132,28 @@ class Violations:
         metric_value: UsageValue,
         diff_ratio: float | None = None,
     ) -> None:
-        violation = self.endpoint_violations[metric.endpoint].violations[metric_value]
+        violation = self.endpoint_violations[metric.endpoint].get(metric_value)
 
-        if metric.access_key not in violation.sent_keys:
-            violation.add_new_key(metric.access_key, diff_ratio)
-        elif metric_value in UsageValue.throughput_values() and diff_ratio is not None:
+        state = violation.key_states.get(metric.access_key)
+        if state is None or not state[0]:
+            violation.add_new_key(metric.access_key, diff_ratio, state)
+        elif metric_value in THROUGHPUT_VALUES and diff_ratio is not None:
             # Only throughput values care about diff ratios.
-            sent_diff_ratio = violation.violation_ratios.get(metric.access_key, 0)
+            sent_diff_ratio = state[1] or 0
             if (diff_ratio - sent_diff_ratio) > self.DIFF_RATIO_RESEND_FACTOR:
-                violation.add_new_key(metric.access_key, diff_ratio, remove_sent=True)
+                violation.add_new_key(metric.access_key, diff_ratio, state)
 
     def endpoints(self) -> KeysView[str]:
         return self.endpoint_violations.keys()
 
     def generate_violation_message(self, endpoint: str, epoch_time: float) -> list[str]:
         violation_messages = []
-        for _, violations in self.endpoint_violations[endpoint].violations.items():
-            if len(violations.new_keys):
-                msg = violations.generate_violation_message(epoch_time)
-
-                violation_messages.append(msg)
-
-                for new_key in violations.new_keys:
-                    violations.sent_keys.add(new_key)
-
-                violations.new_keys = set()
+        # Every message for this endpoint starts with the same timestamp, so only format it once
+        epoch_usec = str(int(epoch_time * USECS_IN_SEC))
+        for violations in self.endpoint_violations[endpoint].in_order():
+            if violations.new_count:
+                violation_messages.append(
+                    violations.generate_violation_message(epoch_usec)
+                )
 
         return violation_messages
@@ -8,32 +8,36 @@ from weir.models.user_metrics import (
 
 
 class MetricService:
+    @staticmethod
+    def _validate_access_key(usage: UserLevelUsage) -> None:
+        if not usage.access_key.isalnum():
+            raise Exception(
+                f"access_key={usage.access_key} has invalid format for key {usage.key}"
+            )
+
     @staticmethod
     def create_user_level_metric(key: str, current_epoch: int) -> UserLevelUsage:
-        items = key.split("_")
-        if not items or items[0] not in ["verb", "conn"]:
+        metric_id, _, rest = key.partition("_")
+        if metric_id not in ("verb", "conn"):
             raise Exception(f"invalid key {key} retrieved from redis-qos")
 
-        def _validate_access_key(usage: UserLevelUsage) -> None:
-            if not usage.access_key.isalnum():
-                raise Exception(
-                    f"access_key={usage.access_key} has invalid format for key {usage.key}"
-                )
-
-        if items[0] == "verb":
-            if len(items) != 4:
+        if metric_id == "verb":
+            # verb_<epoch>_user_<access key>$<endpoint>
+            epoch, _, rest = rest.partition("_")
+            _, separator, acc_key = rest.partition("_")
+            if not separator or "_" in acc_key:
                 raise Exception(f"invalid 'verb' key {key} retrieved from redis-qos")
 
-            verb_usage = UserLevelVerbUsage(key, int(items[1]), items[3])
-            _validate_access_key(verb_usage)
+            verb_usage = UserLevelVerbUsage(key, int(epoch), acc_key)
+            MetricService._validate_access_key(verb_usage)
             return verb_usage
 
-        elif items[0] == "conn":
+        elif metric_id == "conn":
             req_usage = UserLevelActiveRequestsUsage(key, current_epoch)
-            _validate_access_key(req_usage)
+            MetricService._validate_access_key(req_usage)
             return req_usage
         else:
-            raise Exception(f"invalid metric identifier: {items[0]}")
+            raise Exception(f"invalid metric identifier: {metric_id}")
 
     @staticmethod
     def merge_metrics_by_key[T: UserLevelUsage](input_metrics: list[T]) -> list[T]:
@@ -41,16 +45,12 @@ class MetricService:
         Merge matching metrics in a list to produce a new list where each access key only appears once,
         and that one instance accounts for all metrics with that access key in the input list.
         """
-        key_metrics: dict[tuple[str, str, str, int], T] = {}
+        key_metrics: dict[tuple[type, str, str, int], T] = {}
         for metric in input_metrics:
-            metric_id = (
-                type(metric).__name__,
-                metric.access_key,
-                metric.endpoint,
-                metric.epoch,
-            )
-            if metric_id in key_metrics:
-                key_metrics[metric_id].merge_from(metric)
+            metric_id = (type(metric), metric.access_key, metric.endpoint, metric.epoch)
+            merged_metric = key_metrics.get(metric_id)
+            if merged_metric is not None:
+                merged_metric.merge_from(metric)
             else:
                 key_metrics[metric_id] = metric
         return list(key_metrics.values())